@@ -0,0 +1,101 @@
+"""
+Aquecimento da instância, no mesmo processo do servidor Streamlit.
+
+O contêiner inicia por `servidor.py`, que chama `iniciar_aquecimento()` e só
+depois sobe o Streamlit no mesmo processo. O aquecimento abre o pool de conexões
+(a engine de `banco.py`) e preenche os caches do processo (`preparo.py`): dados
+da versão atual com as regras aplicadas, resumo de retroativos e, no modo de
+memória particionado, o processamento das partições. Assim a primeira sessão
+encontra tudo pronto.
+
+A espera é limitada por AQUECIMENTO_TIMEOUT (segundos, padrão 60), para que a
+porta abra dentro do prazo da verificação de inicialização do Cloud Run. Se o
+prazo vencer, o aquecimento continua em segundo plano e as sessões que chegarem
+aguardam o mesmo cálculo (o st.cache_resource calcula cada chave uma única vez)
+em vez de repeti-lo. Falhas são apenas registradas: a aplicação sobe mesmo se o
+banco estiver indisponível.
+
+Também concentra o registro dos tempos de inicialização (import dos módulos,
+conexão, carga, primeira renderização), reportados uma única vez por processo.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("aquecimento")
+
+AQUECIMENTO_TIMEOUT = float(os.getenv("AQUECIMENTO_TIMEOUT", "60"))
+
+_tempos_registrados = set()
+
+
+def registrar_tempo(evento: str, segundos: float) -> None:
+    """
+    Registra no log o tempo de um evento de inicialização, só na primeira vez
+    em que ocorre no processo (o Streamlit reexecuta o script a cada rerun).
+    """
+    if evento in _tempos_registrados:
+        return
+    _tempos_registrados.add(evento)
+    logger.info("%s: %.3f s", evento, segundos)
+
+
+def aquecer() -> bool:
+    """
+    Executa o aquecimento. Retorna True se os caches foram preenchidos.
+    """
+    inicio = time.perf_counter()
+    try:
+        # Os imports pesados do processo (streamlit, pandas, sqlalchemy e os
+        # módulos do painel) acontecem aqui, antes da primeira execução do script
+        from sqlalchemy import text
+
+        import materializacao
+        import memoria
+        import preparo
+        from banco import obter_engine
+        registrar_tempo("Aquecimento: import dos módulos", time.perf_counter() - inicio)
+
+        inicio_conexao = time.perf_counter()
+        with obter_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+        registrar_tempo("Aquecimento: conexão com o banco", time.perf_counter() - inicio_conexao)
+
+        if materializacao.MODO_RESULTADOS == "materializado":
+            # O painel só carrega as linhas de origem sob demanda
+            logger.info("Modo materializado: aquecimento dos dados dispensado")
+            return True
+
+        inicio_carga = time.perf_counter()
+        versao = preparo.versao_dados()
+        plano = preparo.planejar_memoria(versao)
+        logger.info("Modo de memória: %s (%s)", plano.modo, plano.descricao())
+
+        if plano.modo == memoria.MODO_COMPLETO:
+            linhas = len(preparo.preparar_dados(versao))
+            preparo.preparar_retroativo(versao)
+        else:
+            _, _, _, linhas = preparo.preparar_dados_particionado(
+                versao, plano.linhas_por_particao
+            )
+        registrar_tempo("Aquecimento: carga dos dados", time.perf_counter() - inicio_carga)
+        logger.info("Aquecimento concluído: %d linhas em cache", linhas)
+        return True
+    except Exception:
+        logger.exception("Falha no aquecimento; a aplicação seguirá sem cache pré-carregado")
+        return False
+
+
+def iniciar_aquecimento(timeout: float = AQUECIMENTO_TIMEOUT) -> bool:
+    """
+    Executa `aquecer` em uma thread do processo e espera no máximo `timeout`
+    segundos. Retorna True se o aquecimento terminou dentro do prazo.
+    """
+    thread = threading.Thread(target=aquecer, name="aquecimento", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        logger.warning("Aquecimento excedeu %.0f s; continua em segundo plano", timeout)
+        return False
+    return True
@@ -0,0 +1,44 @@
+"""
+Conexão com o banco PostgreSQL.
+
+A engine do SQLAlchemy é criada sob demanda, na primeira chamada de
+`obter_engine()`, e reaproveitada pelo processo inteiro. Como o Streamlit
+reexecuta `stream.py` a cada interação, ela fica neste módulo (importado
+uma única vez) e não no script.
+"""
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_USER = os.getenv("DB_USER", "")
+DB_PASS = os.getenv("DB_PASSWORD", "")
+DB_HOST = os.getenv("DB_HOST", "")
+DB_PORT = os.getenv("DB_PORT", "")
+DB_NAME = os.getenv("DB_NAME", "")
+
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# O pool precisa comportar as consultas paralelas de `ler_dados_geral` (2)
+# mais folga para as sessões que consultam o banco ao mesmo tempo.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "2"))
+
+
+@lru_cache(maxsize=None)
+def obter_engine():
+    """
+    Retorna a engine do processo, criando-a na primeira chamada.
+    pool_pre_ping descarta conexões que o banco fechou enquanto a instância estava ociosa.
+    """
+    from sqlalchemy import create_engine
+
+    return create_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
@@ -0,0 +1,375 @@
+"""
+Cache compartilhado entre instâncias para os DataFrames lidos do banco.
+
+Cada instância do Cloud Run mantém o seu próprio `st.cache_data`; este módulo
+adiciona uma segunda camada, comum a todas as instâncias, onde os DataFrames
+ficam serializados em Parquet sob uma chave que inclui a versão dos dados.
+Uma única instância executa a consulta pesada e as demais reutilizam o resultado.
+
+Backends disponíveis (variável de ambiente CACHE_BACKEND):
+  - "nenhum" (padrão): sem cache compartilhado (sempre consulta o banco)
+  - "disco": diretório local (CACHE_DIR, padrão /tmp/painel-cache)
+  - "compartilhado": diretório em sistema de arquivos compartilhado (CACHE_DIR obrigatório)
+  - "redis": servidor compatível com Redis (REDIS_URL; requer o pacote `redis`,
+    ver app/requirements-opcional.txt)
+
+Os backends em diretório recusam sistemas de arquivos em memória (como o /tmp
+do Cloud Run): lá o cache só duplicaria os dados na RAM da instância. Se o
+backend não puder ser criado, o painel segue sem cache compartilhado.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+import pandas as pd
+
+import memoria
+
+logger = logging.getLogger(__name__)
+
+
+# =========================================================================
+# 1. Serialização
+# =========================================================================
+
+def serializar(df: pd.DataFrame) -> bytes:
+    """
+    Converte o DataFrame em bytes Parquet (Arrow), preservando os tipos das colunas.
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def desserializar(dados: bytes) -> pd.DataFrame:
+    """
+    Operação inversa de `serializar`.
+    """
+    return pd.read_parquet(io.BytesIO(dados))
+
+
+# =========================================================================
+# 2. Backends
+# =========================================================================
+
+class BackendCache:
+    """
+    Interface mínima de um backend: leitura/gravação de bytes por chave
+    e uma trava (lock) com validade, usada para que só uma instância
+    calcule cada chave.
+    """
+
+    def ler(self, chave: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def gravar(self, chave: str, dados: bytes) -> None:
+        raise NotImplementedError
+
+    def adquirir_trava(self, chave: str, validade: int) -> Optional[str]:
+        """
+        Tenta adquirir a trava da chave. Retorna um token se conseguiu,
+        ou None se outra instância já está calculando.
+        """
+        raise NotImplementedError
+
+    def liberar_trava(self, chave: str, token: str) -> None:
+        raise NotImplementedError
+
+
+class CacheNenhum(BackendCache):
+    """
+    Backend vazio: nunca encontra nada e sempre concede a trava.
+    """
+
+    def ler(self, chave: str) -> Optional[bytes]:
+        return None
+
+    def gravar(self, chave: str, dados: bytes) -> None:
+        pass
+
+    def adquirir_trava(self, chave: str, validade: int) -> Optional[str]:
+        return uuid.uuid4().hex
+
+    def liberar_trava(self, chave: str, token: str) -> None:
+        pass
+
+
+class CacheDisco(BackendCache):
+    """
+    Backend em diretório. Serve tanto para disco local quanto para um
+    sistema de arquivos montado em todas as instâncias (Filestore, GCS FUSE etc.).
+
+    - A gravação é atômica (arquivo temporário + os.replace).
+    - A trava é um arquivo criado com O_EXCL; travas mais antigas que a
+      validade são consideradas abandonadas e removidas.
+    - Arquivos com mais de `ttl` segundos são ignorados na leitura.
+    """
+
+    def __init__(self, diretorio: str, ttl: int = 3600):
+        self.diretorio = diretorio
+        self.ttl = ttl
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, chave: str, sufixo: str) -> str:
+        # O nome legível ajuda na depuração; o hash evita caracteres inválidos.
+        prefixo = "".join(c if c.isalnum() else "_" for c in chave)[:60]
+        digest = hashlib.sha1(chave.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.diretorio, f"{prefixo}-{digest}{sufixo}")
+
+    def ler(self, chave: str) -> Optional[bytes]:
+        caminho = self._caminho(chave, ".parquet")
+        try:
+            if time.time() - os.path.getmtime(caminho) > self.ttl:
+                return None
+            with open(caminho, "rb") as arquivo:
+                return arquivo.read()
+        except FileNotFoundError:
+            return None
+
+    def gravar(self, chave: str, dados: bytes) -> None:
+        caminho = self._caminho(chave, ".parquet")
+        temporario = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(dados)
+        os.replace(temporario, caminho)
+        self._limpar_expirados()
+
+    def _limpar_expirados(self) -> None:
+        """
+        Remove arquivos de versões antigas (mais de 2x o ttl), para o diretório não crescer sem limite.
+        """
+        limite = time.time() - 2 * self.ttl
+        for nome in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    os.remove(caminho)
+            except OSError:
+                pass
+
+    def adquirir_trava(self, chave: str, validade: int) -> Optional[str]:
+        caminho = self._caminho(chave, ".lock")
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(caminho, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Trava abandonada (instância morreu no meio do cálculo)?
+            try:
+                if time.time() - os.path.getmtime(caminho) > validade:
+                    os.remove(caminho)
+            except OSError:
+                pass
+            return None
+        with os.fdopen(fd, "w") as arquivo:
+            arquivo.write(token)
+        return token
+
+    def liberar_trava(self, chave: str, token: str) -> None:
+        caminho = self._caminho(chave, ".lock")
+        try:
+            with open(caminho) as arquivo:
+                if arquivo.read() != token:
+                    return
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+class CacheRedis(BackendCache):
+    """
+    Backend para servidores compatíveis com Redis. Recebe qualquer cliente
+    que ofereça get/set(nx=, ex=)/delete, o que permite substituir o servidor
+    real por `ClienteRedisMemoria` em testes.
+    """
+
+    def __init__(self, cliente, ttl: int = 3600, prefixo: str = "painel:"):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefixo = prefixo
+
+    def ler(self, chave: str) -> Optional[bytes]:
+        return self.cliente.get(self.prefixo + chave)
+
+    def gravar(self, chave: str, dados: bytes) -> None:
+        self.cliente.set(self.prefixo + chave, dados, ex=self.ttl)
+
+    def adquirir_trava(self, chave: str, validade: int) -> Optional[str]:
+        token = uuid.uuid4().hex
+        if self.cliente.set(self.prefixo + chave + ":lock", token, nx=True, ex=validade):
+            return token
+        return None
+
+    def liberar_trava(self, chave: str, token: str) -> None:
+        chave_trava = self.prefixo + chave + ":lock"
+        atual = self.cliente.get(chave_trava)
+        if isinstance(atual, bytes):
+            atual = atual.decode("utf-8")
+        if atual == token:
+            self.cliente.delete(chave_trava)
+
+
+class ClienteRedisMemoria:
+    """
+    Substituto local (em memória) do cliente Redis, com o subconjunto de
+    comandos usado por `CacheRedis`. Útil para testes e desenvolvimento.
+    """
+
+    def __init__(self):
+        self._dados = {}
+        self._lock = threading.Lock()
+
+    def _vivo(self, chave):
+        item = self._dados.get(chave)
+        if item is None:
+            return None
+        valor, expira_em = item
+        if expira_em is not None and time.time() >= expira_em:
+            del self._dados[chave]
+            return None
+        return valor
+
+    def get(self, chave):
+        with self._lock:
+            return self._vivo(chave)
+
+    def set(self, chave, valor, ex=None, nx=False):
+        with self._lock:
+            if nx and self._vivo(chave) is not None:
+                return None
+            expira_em = time.time() + ex if ex else None
+            self._dados[chave] = (valor, expira_em)
+            return True
+
+    def delete(self, chave):
+        with self._lock:
+            return 1 if self._dados.pop(chave, None) is not None else 0
+
+
+# =========================================================================
+# 3. Cache com "single-flight"
+# =========================================================================
+
+class CacheCompartilhado:
+    """
+    Envolve um backend e garante que, para cada chave, apenas um cálculo
+    aconteça por vez:
+      - dentro da instância, por um lock por chave (threads da mesma instância);
+      - entre instâncias, pela trava do backend. Quem não consegue a trava
+        aguarda o resultado ser gravado em vez de também consultar o banco.
+    """
+
+    def __init__(self, backend: BackendCache, validade_trava: int = 600, intervalo_espera: float = 0.5):
+        self.backend = backend
+        self.validade_trava = validade_trava
+        self.intervalo_espera = intervalo_espera
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_local(self, chave: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(chave, threading.Lock())
+
+    def _ler(self, chave: str) -> Optional[pd.DataFrame]:
+        try:
+            dados = self.backend.ler(chave)
+        except Exception:
+            logger.exception("Falha ao ler a chave %s do cache compartilhado", chave)
+            return None
+        return desserializar(dados) if dados else None
+
+    def _adquirir_trava(self, chave: str) -> Tuple[Optional[str], bool]:
+        """
+        Retorna (token, disponivel). Se o backend falhar, disponivel=False:
+        não há como coordenar com as outras instâncias, então o cálculo é local.
+        """
+        try:
+            return self.backend.adquirir_trava(chave, self.validade_trava), True
+        except Exception:
+            logger.exception("Falha ao obter a trava da chave %s; calculando sem trava", chave)
+            return None, False
+
+    def _liberar_trava(self, chave: str, token: str) -> None:
+        try:
+            self.backend.liberar_trava(chave, token)
+        except Exception:
+            logger.exception("Falha ao liberar a trava da chave %s", chave)
+
+    def obter_ou_calcular(self, chave: str, calcular: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Retorna o DataFrame da chave, calculando-o (uma única vez) se ainda não existir.
+        """
+        with self._lock_local(chave):
+            df = self._ler(chave)
+            if df is not None:
+                return df
+
+            # Aguarda enquanto outra instância calcula; se a trava expirar ou
+            # for liberada sem resultado, esta instância assume o cálculo.
+            # Se o backend estiver indisponível, calcula direto do banco.
+            limite = time.time() + self.validade_trava
+            token, disponivel = self._adquirir_trava(chave)
+            while disponivel and token is None and time.time() < limite:
+                time.sleep(self.intervalo_espera)
+                df = self._ler(chave)
+                if df is not None:
+                    return df
+                token, disponivel = self._adquirir_trava(chave)
+
+            try:
+                df = calcular()
+                try:
+                    self.backend.gravar(chave, serializar(df))
+                except Exception:
+                    logger.exception("Falha ao gravar a chave %s no cache compartilhado", chave)
+                return df
+            finally:
+                if token is not None:
+                    self._liberar_trava(chave, token)
+
+
+def criar_backend(tipo: str, ttl: int) -> BackendCache:
+    """
+    Cria o backend de acordo com o tipo configurado (ver docstring do módulo).
+    """
+    tipo = (tipo or "nenhum").strip().lower()
+    if tipo == "nenhum":
+        return CacheNenhum()
+    if tipo in ("disco", "compartilhado"):
+        diretorio = os.getenv("CACHE_DIR", "/tmp/painel-cache" if tipo == "disco" else "")
+        if not diretorio:
+            raise ValueError("CACHE_BACKEND=compartilhado exige CACHE_DIR apontando para o volume compartilhado.")
+        if memoria.em_memoria(diretorio):
+            raise ValueError(
+                f"CACHE_DIR={diretorio!r} está em um sistema de arquivos em memória (tmpfs); "
+                "use um volume em disco ou CACHE_BACKEND=redis."
+            )
+        return CacheDisco(diretorio, ttl=ttl)
+    if tipo == "redis":
+        import redis  # dependência opcional, só necessária neste modo
+
+        return CacheRedis(redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")), ttl=ttl)
+    raise ValueError(f"CACHE_BACKEND desconhecido: {tipo!r}")
+
+
+@lru_cache(maxsize=None)
+def obter_cache() -> CacheCompartilhado:
+    """
+    Instância única (por processo) do cache compartilhado, configurada pelas
+    variáveis de ambiente. Se o backend não puder ser criado (pacote `redis`
+    ausente, CACHE_DIR sem permissão ou em memória...), registra o erro e usa
+    `CacheNenhum`: o painel consulta o banco diretamente.
+    """
+    ttl = int(os.getenv("CACHE_TTL", "3600"))
+    tipo = os.getenv("CACHE_BACKEND", "nenhum")
+    try:
+        backend = criar_backend(tipo, ttl)
+    except Exception:
+        logger.exception("Falha ao criar o backend de cache %r; seguindo sem cache compartilhado", tipo)
+        backend = CacheNenhum()
+    return CacheCompartilhado(backend)
@@ -0,0 +1,117 @@
+"""
+Cálculos de conciliação por pedido, compartilhados entre o painel e o job de
+materialização (sem dependência do Streamlit).
+"""
+import pandas as pd
+
+import regras
+from dinheiro import para_reais
+
+
+def calcular_situacao_pedidos(df_geral: pd.DataFrame) -> pd.DataFrame:
+    """
+    Consolida os dados por (marketplace, numero_pedido), com valores em centavos:
+      - data_pedido: menor data_evento do pedido
+      - valor_total: valor do pedido obtido da tabela 'vendas' ('valor_vendas', já vem em df_geral)
+      - comissao_esperada: a maior comissão do grupo para aquele pedido
+      - valor_a_receber = valor_total - comissao_esperada
+      - valor_recebido = o max() de valor_final dos eventos de papel "recebido" (Repasse Normal)
+      - valor_descontado = devolução (Hove/Houve) + soma dos retroativos
+      - desconto_frete = soma dos eventos de papel "frete" (Reversa Centauro Envios)
+      - situacao_pagamento (ex.: "pago", "pago a maior", "pago a menor", "nao pago")
+      - situacao_final (ex.: "Erro Devolução", "Correta") ou a situacao do pagamento
+
+    O papel de cada evento e as condições de cada situação (com as suas
+    tolerâncias) vêm da configuração do marketplace em `regras.py`. Todos os valores são agregados
+    e comparados em centavos inteiros.
+    """
+    papel = regras.papel_evento(df_geral)
+    valor_final = df_geral["valor_final_centavos"]
+
+    # Colunas auxiliares: valor_final apenas nas linhas de cada papel
+    # (NaN nas demais, para não interferir no max/sum do grupo).
+    aux = pd.DataFrame({
+        "marketplace": df_geral["marketplace"],
+        "numero_pedido": df_geral["numero_pedido"],
+        "data_evento": pd.to_datetime(df_geral["data_evento"], errors="coerce"),
+        "valor_vendas_centavos": df_geral["valor_vendas_centavos"],
+        "comissao_centavos": df_geral["comissao_centavos"],
+        "recebido": valor_final.where(papel == "recebido"),
+        "hove": valor_final.where(papel == "devolucao"),
+        "retro": valor_final.where(papel == "retroativo"),
+        "frete": valor_final.where(papel == "frete"),
+    })
+
+    # Agrupamos por (marketplace, numero_pedido)
+    g = aux.groupby(["marketplace", "numero_pedido"]).agg(
+        data_pedido=("data_evento", "min"),              # menor data_evento do grupo
+        valor_total=("valor_vendas_centavos", "max"),    # geralmente igual em todas as linhas
+        comissao_esperada=("comissao_centavos", "max"),
+        valor_recebido=("recebido", "max"),              # Repasse Normal
+        valor_hove=("hove", "max"),                      # max() para Hove/Houve (pode haver variações)
+        valor_retro=("retro", "sum"),                    # soma de todas as linhas de retroativo
+        desconto_frete=("frete", "sum"),
+    ).reset_index()
+
+    # Valores do grupo em centavos inteiros (ausente => 0)
+    for coluna in ["valor_total", "comissao_esperada", "valor_recebido", "valor_hove", "valor_retro", "desconto_frete"]:
+        g[coluna] = g[coluna].fillna(0).astype("int64")
+
+    g["valor_a_receber"] = g["valor_total"] - g["comissao_esperada"]
+    g["valor_descontado"] = g["valor_hove"] + g["valor_retro"]
+
+    # Situações declaradas na configuração do marketplace (ver `regras.Situacao`)
+    situacao_pag, situacao_final = regras.classificar_situacoes(g)
+
+    return pd.DataFrame({
+        "marketplace": g["marketplace"],
+        "numero_pedido": g["numero_pedido"],
+        "data_pedido": g["data_pedido"],
+        "valor_total": g["valor_total"],
+        "comissao_esperada": g["comissao_esperada"],
+        "valor_a_receber": g["valor_a_receber"],
+        "valor_recebido": g["valor_recebido"],
+        "valor_descontado": g["valor_descontado"],
+        "desconto_frete": g["desconto_frete"],
+        "situacao_pagamento": situacao_pag,
+        "situacao_final": situacao_final,
+    })
+
+
+def verificar_descontar_retroativo(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Resumo por pedido dos eventos "Descontar Retroativo": valor_liquido do pedido,
+    soma de valor_final (repasse_liquido_evento) e a diferença entre eles.
+    A marcação "ERRO_DESCONTAR_RETROATIVO" vem da regra declarada em `regras.py`
+    (coluna 'erro_descontar_retroativo', criada por `preparar_dados`), que também
+    alimenta `lista_erros` e o filtro por erro.
+
+    Um único groupby sobre as linhas de retroativo; é calculado uma vez por
+    versão dos dados (ver `preparar_retroativo`), e não a cada rerun.
+    """
+    subset = df[df["tipo_evento_normalizado"] == regras.DESCONTAR_RETROATIVO]
+    if subset.empty:
+        return pd.DataFrame(columns=[
+            "numero_pedido",
+            "valor_liquido",
+            "soma_descontar_retroativo",
+            "Diferenca",
+            "erro_descontar_retroativo"
+        ])
+
+    grouped = subset.groupby("numero_pedido").agg(
+        valor_liquido=("valor_liquido", "first"),                      # valor base do pedido
+        valor_liquido_centavos=("valor_liquido_centavos", "first"),
+        soma_descontar_retroativo=("valor_final", "sum"),              # soma dos valores "Descontar Retroativo"
+        soma_centavos=("valor_final_centavos", "sum"),
+        erro_descontar_retroativo=("erro_descontar_retroativo", "first"),
+    ).reset_index()
+
+    grouped["Diferenca"] = para_reais(grouped["valor_liquido_centavos"] + grouped["soma_centavos"])
+    return grouped[[
+        "numero_pedido",
+        "valor_liquido",
+        "soma_descontar_retroativo",
+        "Diferenca",
+        "erro_descontar_retroativo"
+    ]]
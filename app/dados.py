@@ -0,0 +1,223 @@
+"""
+Leitura dos dados de conciliação no PostgreSQL.
+
+Sem dependência do Streamlit: é usado pelo painel (`stream.py`, por meio do
+cache compartilhado), pelo aquecimento e pelo job de materialização, que lê a
+origem diretamente.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import pandas as pd
+from sqlalchemy import text
+
+import regras
+from banco import obter_engine
+from dinheiro import para_centavos, para_pontos_base, aplicar_pontos_base
+
+logger = logging.getLogger("dados")
+
+
+# Pedidos com marketplace, venda e comissão (uma única varredura de 'vendas').
+# 'valor_vendas' é o maior valor_liquido entre as vendas do mesmo SKU,
+# calculado por janela para não precisar reler a tabela 'vendas'.
+SQL_PEDIDOS = """
+    SELECT
+        mk.nome AS marketplace,
+        sm.id AS sku_marketplace_id,
+        sm.numero_pedido,
+
+        -- Valor do pedido (universal) buscado da tabela vendas:
+        COALESCE(v.valor_liquido, 0) AS valor_liquido,
+        MAX(v.valor_liquido) OVER (PARTITION BY sm.id) AS valor_vendas,
+
+        -- Data e porcentagem da comissão:
+        cp.data AS data_comissao,
+        cp.porcentagem,
+
+        -- Cálculo da comissão baseado no valor de 'vendas':
+        (cp.porcentagem * COALESCE(v.valor_liquido, 0)) AS comissao_calc,
+
+        v.data AS data_evento
+
+    FROM sku_marketplace sm
+    LEFT JOIN marketplaces mk
+        ON sm.marketplace_id = mk.id
+    LEFT JOIN vendas v
+        ON sm.id = v.sku_marketplace_id
+    LEFT JOIN comissoes_pedido cp
+        ON sm.id = cp.sku_marketplace_id
+"""
+
+# Eventos de repasse da Centauro. Pedidos nulos são descartados, pois não
+# casariam no JOIN do SQL (o merge do pandas casaria NaN com NaN).
+SQL_EVENTOS = """
+    SELECT
+        ec.numero_pedido,
+        ec.tipo_evento,
+        COALESCE(ec.repasse_liquido_evento, 0) AS valor_final,
+        ec.data_repasse AS data_ciclo
+    FROM evento_centauro ec
+    WHERE ec.numero_pedido IS NOT NULL
+"""
+
+
+def ler_dados_geral() -> pd.DataFrame:
+    """
+    Lê dados de diversas tabelas do banco:
+    - sku_marketplace (sm)
+    - marketplaces (mk)
+    - comissoes_pedido (cp)
+    - vendas (v)
+    - evento_centauro (ec)
+
+    A leitura é dividida em duas consultas executadas em paralelo, cada uma
+    varrendo suas tabelas uma única vez (ver `ler_pedidos` e `ler_eventos`).
+    Os eventos são então unidos aos pedidos por numero_pedido (LEFT JOIN),
+    consolidando:
+      - marketplace (nome)
+      - sku_marketplace_id (ligado à tabela `sku_marketplace`)
+      - número do pedido
+      - valor_liquido (do pedido) vem de 'vendas'
+      - valor_vendas (maior valor_liquido das vendas do SKU, sem COALESCE)
+      - data e porcentagem da comissão (de comissoes_pedido)
+      - cálculo da comissão = porcentagem * valor_liquido
+      - tipo de evento e valor_final (repasse_liquido_evento) vindos de 'evento_centauro'
+      - data do pedido (de vendas)
+      - data do repasse (data_ciclo) do evento_centauro
+
+    Depois, preenche valores nulos com zero ou strings vazias,
+    e normaliza o tipo_evento para valores padronizados (Repasse Normal, etc.).
+    Retorna um DataFrame pronto para ser exibido/filtrado.
+    """
+    # Tempo total ~ consulta mais lenta, e não a soma das duas.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futuro_pedidos = executor.submit(ler_pedidos)
+        futuro_eventos = executor.submit(ler_eventos)
+        df_pedidos = futuro_pedidos.result()
+        df_eventos = futuro_eventos.result()
+
+    return _completar(df_pedidos.merge(df_eventos, how="left", on="numero_pedido"))
+
+
+def ler_dados_geral_em_blocos(linhas_por_bloco: int) -> Iterator[pd.DataFrame]:
+    """
+    Os mesmos dados de `ler_dados_geral`, lidos em uma única consulta
+    (pedidos LEFT JOIN eventos, no banco) ordenada por numero_pedido e
+    entregues em blocos de cerca de `linhas_por_bloco` linhas, sem que um
+    pedido se divida entre blocos (ver `blocos_por_pedido`). Usado pelo modo
+    de memória particionado (`memoria.py`): as tabelas são percorridas uma
+    única vez e, com o cursor do lado do servidor (stream_results), só o
+    bloco atual fica em memória. A conexão fica aberta até o fim da iteração.
+    """
+    query = text(f"""
+        WITH pedidos AS ({SQL_PEDIDOS}),
+        eventos AS ({SQL_EVENTOS})
+        SELECT p.*, e.tipo_evento, e.valor_final, e.data_ciclo
+        FROM pedidos p
+        LEFT JOIN eventos e
+            ON e.numero_pedido = p.numero_pedido
+        ORDER BY p.numero_pedido;
+    """)
+    with obter_engine().connect().execution_options(stream_results=True) as conn:
+        blocos = pd.read_sql(query, conn, chunksize=linhas_por_bloco)
+        for bloco in blocos_por_pedido(blocos):
+            yield _completar(bloco)
+
+
+def blocos_por_pedido(blocos: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Recorta blocos ordenados por numero_pedido nas fronteiras entre pedidos:
+    as linhas do último pedido de cada bloco passam para o bloco seguinte, já
+    que podem continuar nele. Pedidos nulos (ao fim da ordenação) ficam juntos.
+    Sem nenhuma linha, entrega um único bloco vazio (com as colunas).
+    """
+    pendente = None
+    entregues = 0
+    for bloco in blocos:
+        if pendente is not None:
+            bloco = pd.concat([pendente, bloco], ignore_index=True)
+        pedidos = bloco["numero_pedido"]
+        ultimo = pedidos.iloc[-1] if len(bloco) else None
+        if pd.isnull(ultimo):
+            do_ultimo = pedidos.isnull()
+        else:
+            do_ultimo = pedidos == ultimo
+        pendente = bloco[do_ultimo]
+        if not do_ultimo.all():
+            entregues += 1
+            yield bloco[~do_ultimo].reset_index(drop=True)
+    if pendente is not None and (len(pendente) or not entregues):
+        yield pendente.reset_index(drop=True)
+
+
+def _completar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Preenche os nulos e acrescenta as colunas em ponto fixo e o evento padronizado.
+    """
+    # Preenche valores nulos em colunas-chave
+    df["valor_liquido"] = df["valor_liquido"].fillna(0)
+    df["valor_vendas"] = df["valor_vendas"].fillna(0)
+    df["valor_final"] = df["valor_final"].fillna(0)
+    df["porcentagem"] = df["porcentagem"].fillna(0)
+    df["tipo_evento"] = df["tipo_evento"].fillna("")
+
+    # Representação em ponto fixo (centavos / pontos-base) usada nas verificações.
+    # As colunas em reais continuam existindo apenas para exibição.
+    df["valor_liquido_centavos"] = para_centavos(df["valor_liquido"])
+    df["valor_vendas_centavos"] = para_centavos(df["valor_vendas"])
+    df["valor_final_centavos"] = para_centavos(df["valor_final"])
+    df["porcentagem_pb"] = para_pontos_base(df["porcentagem"])
+    df["comissao_centavos"] = aplicar_pontos_base(df["valor_liquido_centavos"], df["porcentagem_pb"])
+
+    # Cria uma coluna de tipo_evento_normalizado para unificar valores semelhantes.
+    df["tipo_evento_normalizado"] = regras.normalizar_eventos(df)
+
+    return df
+
+
+def ler_pedidos() -> pd.DataFrame:
+    """
+    Pedidos com marketplace, venda e comissão (ver `SQL_PEDIDOS`).
+    """
+    with obter_engine().connect() as conn:
+        return pd.read_sql(text(SQL_PEDIDOS), conn)
+
+
+def ler_eventos() -> pd.DataFrame:
+    """
+    Eventos de repasse da Centauro (ver `SQL_EVENTOS`).
+    """
+    with obter_engine().connect() as conn:
+        return pd.read_sql(text(SQL_EVENTOS), conn)
+
+
+def estimar_linhas_dados() -> int:
+    """
+    Estimativa do planejador do Postgres (EXPLAIN, sem executar a consulta)
+    para o número de linhas do DataFrame de `ler_dados_geral`. Retorna 0 se a
+    estimativa falhar, o que mantém o modo completo.
+    """
+    query = text("""
+        EXPLAIN (FORMAT JSON)
+        SELECT 1
+        FROM sku_marketplace sm
+        LEFT JOIN vendas v
+            ON sm.id = v.sku_marketplace_id
+        LEFT JOIN comissoes_pedido cp
+            ON sm.id = cp.sku_marketplace_id
+        LEFT JOIN evento_centauro ec
+            ON ec.numero_pedido = sm.numero_pedido;
+    """)
+    try:
+        with obter_engine().connect() as conn:
+            plano = conn.execute(query).scalar()
+        # Conforme o driver, o JSON já chega convertido em lista
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        return int(plano[0]["Plan"]["Plan Rows"])
+    except Exception:
+        logger.exception("Falha ao estimar o tamanho dos dados")
+        return 0
@@ -0,0 +1,58 @@
+"""
+Representação de dinheiro em ponto fixo.
+
+Valores em reais viram centavos inteiros (int64) e porcentagens (frações,
+ex.: 0.16 = 16%) viram pontos-base inteiros (1 pb = 0,01% = 0.0001).
+Assim as comparações com tolerância (R$0,05, R$0,01) são operações inteiras,
+exatas e vetorizadas, sem `round()` por linha nem `!=` entre floats.
+"""
+import numpy as np
+import pandas as pd
+
+CENTAVOS_POR_REAL = 100
+PONTOS_BASE_POR_UNIDADE = 10_000
+
+# Folga para absorver o erro de representação binária antes do arredondamento
+# (ex.: 0.285 * 100 = 28.499999999999996, que deve virar 29 centavos).
+_EPSILON = 1e-6
+
+
+def _arredondar_inteiro(valores: pd.Series, escala: int) -> pd.Series:
+    """
+    Multiplica pela escala e arredonda "meio para longe do zero", retornando int64.
+    Nulos viram 0. Aceita floats, inteiros e Decimal (colunas numeric do Postgres).
+    """
+    numeros = pd.to_numeric(valores, errors="coerce").fillna(0).astype("float64") * escala
+    inteiros = np.sign(numeros) * np.floor(np.abs(numeros) + 0.5 + _EPSILON)
+    return pd.Series(inteiros, index=valores.index).astype("int64")
+
+
+def para_centavos(valores: pd.Series) -> pd.Series:
+    """
+    Reais -> centavos inteiros.
+    """
+    return _arredondar_inteiro(valores, CENTAVOS_POR_REAL)
+
+
+def para_pontos_base(porcentagens: pd.Series) -> pd.Series:
+    """
+    Fração (0.1234) -> pontos-base inteiros (1234), ou seja, 4 casas decimais.
+    """
+    return _arredondar_inteiro(porcentagens, PONTOS_BASE_POR_UNIDADE)
+
+
+def aplicar_pontos_base(centavos: pd.Series, pontos_base: pd.Series) -> pd.Series:
+    """
+    Calcula `centavos * porcentagem` em aritmética inteira, arredondando
+    o resultado para o centavo mais próximo (meio para longe do zero).
+    """
+    produto = centavos.astype("int64") * pontos_base.astype("int64")
+    metade = PONTOS_BASE_POR_UNIDADE // 2
+    return np.sign(produto) * ((produto.abs() + metade) // PONTOS_BASE_POR_UNIDADE)
+
+
+def para_reais(centavos: pd.Series) -> pd.Series:
+    """
+    Centavos inteiros -> reais (float), apenas para exibição.
+    """
+    return centavos / CENTAVOS_POR_REAL
@@ -0,0 +1,393 @@
+"""
+Materialização dos resultados da conciliação no PostgreSQL.
+
+Grava, por pedido (marketplace, numero_pedido), os veredictos que o painel
+calcularia a cada sessão: erro de comissão, erro de devolução, lista de erros,
+valores do Resumo Financeiro, situação do pagamento e situação final.
+
+Uso (por exemplo, em um job agendado):
+
+    python app/materializacao.py             # recalcula só os pedidos alterados
+    python app/materializacao.py --completo  # recalcula todos os pedidos
+
+Cada pedido guarda um hash das suas linhas de origem (e das regras em vigor);
+apenas os pedidos cujo hash mudou desde a última execução são recalculados.
+Os resultados são enviados com COPY para uma tabela temporária e aplicados com
+upsert. Mudanças de situação ficam em `resultado_conciliacao_historico`, e
+`correta_desde` registra quando o pedido passou a "Correta".
+
+Com MODO_RESULTADOS=materializado, o Resumo Financeiro do painel lê esta tabela
+(`ler_resultados`) em vez de recalcular os veredictos.
+"""
+import argparse
+import io
+import logging
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import regras
+from banco import obter_engine
+from conciliacao import calcular_situacao_pedidos
+
+logger = logging.getLogger("materializacao")
+
+MODO_RESULTADOS = os.getenv("MODO_RESULTADOS", "calcular")
+
+TABELA = "resultado_conciliacao"
+TABELA_HISTORICO = "resultado_conciliacao_historico"
+TABELA_EXECUCOES = "resultado_conciliacao_execucao"
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS {TABELA} (
+    marketplace TEXT NOT NULL,
+    numero_pedido TEXT NOT NULL,
+    hash_origem BIGINT NOT NULL,
+    data_pedido DATE,
+    valor_total BIGINT NOT NULL,
+    comissao_esperada BIGINT NOT NULL,
+    valor_a_receber BIGINT NOT NULL,
+    valor_recebido BIGINT NOT NULL,
+    valor_descontado BIGINT NOT NULL,
+    desconto_frete BIGINT NOT NULL,
+    erro_comissao BOOLEAN NOT NULL,
+    erro_descontar BOOLEAN NOT NULL,
+    lista_erros TEXT[] NOT NULL,
+    situacao_pagamento TEXT NOT NULL,
+    situacao_final TEXT NOT NULL,
+    correta_desde TIMESTAMPTZ,
+    calculado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (marketplace, numero_pedido)
+);
+CREATE INDEX IF NOT EXISTS ix_{TABELA}_numero_pedido ON {TABELA} (numero_pedido);
+CREATE INDEX IF NOT EXISTS ix_{TABELA}_situacao_final ON {TABELA} (situacao_final);
+
+CREATE TABLE IF NOT EXISTS {TABELA_HISTORICO} (
+    marketplace TEXT NOT NULL,
+    numero_pedido TEXT NOT NULL,
+    situacao_pagamento TEXT NOT NULL,
+    situacao_final TEXT NOT NULL,
+    lista_erros TEXT[] NOT NULL,
+    registrado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS ix_{TABELA_HISTORICO}_pedido
+    ON {TABELA_HISTORICO} (marketplace, numero_pedido, registrado_em);
+
+CREATE TABLE IF NOT EXISTS {TABELA_EXECUCOES} (
+    executado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    pedidos_gravados INTEGER NOT NULL,
+    pedidos_removidos INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_{TABELA_EXECUCOES}_executado_em ON {TABELA_EXECUCOES} (executado_em);
+"""
+
+# Busca por trecho do número do pedido (LIKE '%x%'): um índice btree não atende
+# curingas no início, um índice de trigramas (pg_trgm) sim.
+DDL_TRIGRAMAS = f"""
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS ix_{TABELA}_numero_pedido_trgm
+    ON {TABELA} USING gin (numero_pedido gin_trgm_ops);
+"""
+
+# Colunas na ordem do COPY (iguais às da tabela, exceto correta_desde/calculado_em)
+COLUNAS = [
+    "marketplace", "numero_pedido", "hash_origem", "data_pedido",
+    "valor_total", "comissao_esperada", "valor_a_receber", "valor_recebido",
+    "valor_descontado", "desconto_frete",
+    "erro_comissao", "erro_descontar", "lista_erros",
+    "situacao_pagamento", "situacao_final",
+]
+
+# Colunas devolvidas por `ler_resultados`
+COLUNAS_LEITURA = [
+    "marketplace", "numero_pedido", "data_pedido",
+    "valor_total", "comissao_esperada", "valor_a_receber", "valor_recebido",
+    "valor_descontado", "desconto_frete",
+    "situacao_pagamento", "situacao_final", "lista_erros",
+    "correta_desde", "calculado_em",
+]
+
+# Colunas de origem que definem o resultado de um pedido
+COLUNAS_ORIGEM = [
+    "marketplace", "sku_marketplace_id", "numero_pedido",
+    "valor_liquido_centavos", "valor_vendas_centavos", "porcentagem_pb",
+    "data_comissao", "tipo_evento", "valor_final_centavos", "data_evento", "data_ciclo",
+]
+
+
+def criar_tabelas() -> None:
+    """
+    Cria as tabelas de resultados e seus índices, se ainda não existirem.
+    O índice de trigramas exige a extensão pg_trgm; sem permissão para criá-la,
+    o job segue e a busca por trecho do pedido percorre a tabela.
+    """
+    with obter_engine().begin() as conn:
+        for comando in DDL.split(";"):
+            if comando.strip():
+                conn.execute(text(comando))
+    try:
+        with obter_engine().begin() as conn:
+            for comando in DDL_TRIGRAMAS.split(";"):
+                if comando.strip():
+                    conn.execute(text(comando))
+    except Exception:
+        logger.warning("Não foi possível criar o índice de trigramas (pg_trgm)", exc_info=True)
+
+
+def hash_pedidos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Hash de cada pedido: soma dos hashes das suas linhas de origem (independe
+    da ordem das linhas), combinada com o hash das regras em vigor, para que
+    uma mudança nas regras recalcule todos os pedidos.
+    """
+    por_linha = pd.util.hash_pandas_object(df[COLUNAS_ORIGEM].astype(str), index=False)
+    # 31 bits por linha: a soma por pedido cabe com folga em um BIGINT
+    parcial = pd.Series((por_linha.to_numpy() >> np.uint64(33)).astype("int64"), index=df.index)
+    hash_regras = zlib.crc32(repr(regras.CONFIGURACOES).encode("utf-8"))
+
+    chaves = _chaves(df)
+    hashes = parcial.groupby([chaves["marketplace"], chaves["numero_pedido"]]).sum() + hash_regras
+    return hashes.rename("hash_origem").reset_index()
+
+
+def _chaves(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Chave (marketplace, numero_pedido) como texto, como na tabela de resultados.
+    Linhas sem marketplace ou sem pedido ficam de fora (como no Resumo Financeiro).
+    """
+    return pd.DataFrame({
+        "marketplace": df["marketplace"].where(df["marketplace"].notna()).astype("string"),
+        "numero_pedido": df["numero_pedido"].where(df["numero_pedido"].notna()).astype("string"),
+    }, index=df.index)
+
+
+def calcular_resultados(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Veredictos por pedido, nas colunas de `COLUNAS` (exceto hash_origem).
+    """
+    df = df.join(regras.aplicar_regras(df))
+    chaves = _chaves(df)
+    grupos = [chaves["marketplace"], chaves["numero_pedido"]]
+
+    # Erros por pedido: qualquer linha marcada marca o pedido
+    rotulos = regras.rotulos_erro()
+    bits = pd.DataFrame({
+        rotulo: (df["codigo_erros"] & (1 << i)) != 0 for i, rotulo in enumerate(rotulos)
+    }, index=df.index)
+    bits["erro_comissao"] = df["erro_comissao"] == "ERRO"
+    bits["erro_descontar"] = df["erro_descontar"] == "ERRO_DEVOLUCAO"
+    erros = bits.groupby(grupos).any()
+    codigo_pedido = sum(np.left_shift(erros[r].to_numpy(dtype="int64"), i) for i, r in enumerate(rotulos))
+    erros["lista_erros"] = regras.listas_de_erros(pd.Series(codigo_pedido, index=erros.index), rotulos)
+    erros = erros[["erro_comissao", "erro_descontar", "lista_erros"]].reset_index()
+
+    situacao = calcular_situacao_pedidos(df)
+    situacao["marketplace"] = situacao["marketplace"].astype("string")
+    situacao["numero_pedido"] = situacao["numero_pedido"].astype("string")
+    situacao["data_pedido"] = situacao["data_pedido"].dt.date
+
+    return situacao.merge(erros, on=["marketplace", "numero_pedido"], how="left")
+
+
+def _array_pg(valores: list) -> str:
+    """
+    Literal de array de texto do PostgreSQL (ex.: {"Erro A","Erro B"}).
+    """
+    itens = ('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in valores)
+    return "{" + ",".join(itens) + "}"
+
+
+def _copiar(cursor, tabela: str, df: pd.DataFrame, colunas: list) -> None:
+    """
+    Envia o DataFrame para a tabela com COPY (CSV; campos vazios viram NULL).
+    """
+    buffer = io.StringIO()
+    df[colunas].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def gravar_resultados(resultados: pd.DataFrame, removidos: pd.DataFrame) -> None:
+    """
+    Aplica os resultados em uma única transação:
+      1) COPY para tabelas temporárias;
+      2) histórico das situações que mudaram;
+      3) upsert em `resultado_conciliacao` (atualizando correta_desde);
+      4) remoção dos pedidos que não existem mais na origem;
+      5) registro da execução (ver `ultima_execucao`).
+    """
+    resultados = resultados.copy()
+    resultados["lista_erros"] = resultados["lista_erros"].map(_array_pg)
+
+    conexao = obter_engine().raw_connection()
+    try:
+        cursor = conexao.cursor()
+        cursor.execute(f"CREATE TEMP TABLE tmp_resultado (LIKE {TABELA} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.execute("CREATE TEMP TABLE tmp_removido (marketplace TEXT, numero_pedido TEXT) ON COMMIT DROP")
+        _copiar(cursor, "tmp_resultado", resultados, COLUNAS)
+        _copiar(cursor, "tmp_removido", removidos, ["marketplace", "numero_pedido"])
+
+        cursor.execute(f"""
+            INSERT INTO {TABELA_HISTORICO}
+                (marketplace, numero_pedido, situacao_pagamento, situacao_final, lista_erros)
+            SELECT t.marketplace, t.numero_pedido, t.situacao_pagamento, t.situacao_final, t.lista_erros
+            FROM tmp_resultado t
+            LEFT JOIN {TABELA} r USING (marketplace, numero_pedido)
+            WHERE r.numero_pedido IS NULL
+               OR r.situacao_final IS DISTINCT FROM t.situacao_final
+               OR r.situacao_pagamento IS DISTINCT FROM t.situacao_pagamento
+               OR r.lista_erros IS DISTINCT FROM t.lista_erros
+        """)
+
+        atualizacoes = ",\n                ".join(
+            f"{c} = EXCLUDED.{c}" for c in COLUNAS if c not in ("marketplace", "numero_pedido")
+        )
+        cursor.execute(f"""
+            INSERT INTO {TABELA} ({", ".join(COLUNAS)}, correta_desde)
+            SELECT {", ".join(COLUNAS)},
+                   CASE WHEN situacao_final = 'Correta' THEN now() END
+            FROM tmp_resultado
+            ON CONFLICT (marketplace, numero_pedido) DO UPDATE SET
+                {atualizacoes},
+                correta_desde = CASE
+                    WHEN EXCLUDED.situacao_final = 'Correta'
+                        THEN COALESCE({TABELA}.correta_desde, now())
+                    END,
+                calculado_em = now()
+        """)
+
+        cursor.execute(f"""
+            DELETE FROM {TABELA} r
+            USING tmp_removido t
+            WHERE r.marketplace = t.marketplace AND r.numero_pedido = t.numero_pedido
+        """)
+        cursor.execute(
+            f"INSERT INTO {TABELA_EXECUCOES} (pedidos_gravados, pedidos_removidos) VALUES (%s, %s)",
+            (len(resultados), len(removidos)),
+        )
+        conexao.commit()
+    except Exception:
+        conexao.rollback()
+        raise
+    finally:
+        conexao.close()
+
+
+def comparar_hashes(atuais: pd.DataFrame, gravados: pd.DataFrame, completo: bool = False):
+    """
+    Compara os hashes da origem com os gravados. Retorna (alterados, removidos):
+      - alterados: pedidos da origem com hash novo ou diferente (todos, se `completo`)
+      - removidos: pedidos gravados que não existem mais na origem
+    """
+    gravados = gravados.astype({"marketplace": "string", "numero_pedido": "string"})
+    comparacao = atuais.merge(
+        gravados, on=["marketplace", "numero_pedido"], how="outer",
+        suffixes=("", "_gravado"), indicator=True,
+    )
+    removidos = comparacao.loc[comparacao["_merge"] == "right_only", ["marketplace", "numero_pedido"]]
+    comparacao = comparacao[comparacao["_merge"] != "right_only"]
+    # O merge outer converte hash_origem em float quando há pedidos só na tabela;
+    # o COPY para a coluna BIGINT exige inteiros.
+    comparacao = comparacao.astype({"hash_origem": "int64"})
+    if completo:
+        alterados = comparacao
+    else:
+        alterados = comparacao[comparacao["hash_origem"] != comparacao["hash_origem_gravado"]]
+    return alterados, removidos
+
+
+def materializar(df: pd.DataFrame, completo: bool = False) -> int:
+    """
+    Recalcula e grava os pedidos cujas linhas de origem mudaram desde a última
+    execução (ou todos, se `completo`). Retorna o número de pedidos gravados.
+    """
+    criar_tabelas()
+
+    atuais = hash_pedidos(df)
+    with obter_engine().connect() as conn:
+        gravados = pd.read_sql(text(f"SELECT marketplace, numero_pedido, hash_origem FROM {TABELA}"), conn)
+    alterados, removidos = comparar_hashes(atuais, gravados, completo)
+
+    logger.info(
+        "%d pedidos na origem, %d alterados, %d removidos",
+        len(atuais), len(alterados), len(removidos),
+    )
+    if alterados.empty and removidos.empty:
+        return 0
+
+    # Recalcula todas as linhas dos pedidos alterados (as regras por pedido
+    # agrupam por numero_pedido) e grava só as chaves alteradas.
+    linhas = _chaves(df)["numero_pedido"].isin(alterados["numero_pedido"])
+    resultados = calcular_resultados(df[linhas])
+    resultados = resultados.merge(
+        alterados[["marketplace", "numero_pedido", "hash_origem"]],
+        on=["marketplace", "numero_pedido"],
+    )
+
+    gravar_resultados(resultados, removidos)
+    return len(resultados)
+
+
+def _tabela_existe(conn, tabela: str) -> bool:
+    """
+    True se a tabela já foi criada (o job cria as tabelas na primeira execução).
+    """
+    return conn.execute(text("SELECT to_regclass(:tabela)"), {"tabela": tabela}).scalar() is not None
+
+
+def ler_resultados(situacoes: list, pedido: str = "") -> pd.DataFrame:
+    """
+    Lê os veredictos gravados, filtrando no banco por situação final (índice
+    btree) e por trecho do número do pedido (índice de trigramas, que o Postgres
+    só usa para trechos de 3 caracteres ou mais). Vazio se o job ainda não rodou.
+    """
+    condicoes = []
+    parametros = {}
+    if situacoes:
+        condicoes.append("situacao_final = ANY(:situacoes)")
+        parametros["situacoes"] = list(situacoes)
+    if pedido:
+        condicoes.append("numero_pedido LIKE :pedido")
+        parametros["pedido"] = f"%{pedido}%"
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+
+    query = text(f"""
+        SELECT {", ".join(COLUNAS_LEITURA)}
+        FROM {TABELA}
+        {where}
+        ORDER BY marketplace, numero_pedido
+    """)
+    with obter_engine().connect() as conn:
+        if not _tabela_existe(conn, TABELA):
+            return pd.DataFrame(columns=COLUNAS_LEITURA)
+        return pd.read_sql(query, conn, params=parametros)
+
+
+def ultima_execucao() -> str:
+    """
+    Momento da última execução do job que alterou a tabela ("" se nenhuma,
+    inclusive se as tabelas ainda não existem), usado pelo painel como chave de
+    cache dos resultados.
+    """
+    with obter_engine().connect() as conn:
+        if not _tabela_existe(conn, TABELA_EXECUCOES):
+            return ""
+        marca = conn.execute(text(f"SELECT max(executado_em) FROM {TABELA_EXECUCOES}")).scalar()
+    return "" if marca is None else marca.isoformat()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Materializa os resultados da conciliação no PostgreSQL.")
+    parser.add_argument("--completo", action="store_true", help="recalcula todos os pedidos")
+    argumentos = parser.parse_args()
+
+    # Lê a origem diretamente, sem o cache compartilhado do painel, que pode
+    # guardar dados de até CACHE_TTL segundos atrás.
+    from dados import ler_dados_geral
+
+    total = materializar(ler_dados_geral(), completo=argumentos.completo)
+    logger.info("%d pedidos gravados", total)
@@ -0,0 +1,266 @@
+"""
+Orçamento de memória para a carga dos dados.
+
+Antes de materializar o DataFrame principal, estimamos o seu tamanho a partir
+da estimativa de linhas do planejador do Postgres (EXPLAIN) e o comparamos com
+o orçamento configurado:
+
+  - "completo": cabe no orçamento; o painel funciona como sempre.
+  - "particionado": não cabe. Os dados são lidos em uma única consulta,
+    ordenada pelo número do pedido, e processados em partições (blocos de
+    linhas cortados entre pedidos, então cada pedido fica inteiro em uma
+    partição). Cada partição é gravada em disco em um arquivo Arrow e liberada
+    da memória; ficam em memória apenas o Resumo Financeiro por pedido e uma
+    amostra das linhas para a "Visão Geral". Buscas por número do pedido leem
+    os arquivos Arrow (mapeados em memória), trazendo só as linhas encontradas.
+
+Variáveis de ambiente:
+  - MEMORIA_ORCAMENTO_MB: orçamento em MB (padrão: metade do limite do contêiner, ou 2048)
+  - MEMORIA_BYTES_POR_LINHA: bytes estimados por linha, já contando as cópias
+    feitas por merges, filtros e Styler (padrão 1500)
+  - MEMORIA_AMOSTRA_LINHAS: tamanho da amostra da "Visão Geral" (padrão 50000)
+  - MEMORIA_BUSCA_MAX_LINHAS: máximo de linhas trazidas por uma busca por pedido (padrão 5000)
+  - MEMORIA_DIR: diretório dos arquivos Arrow (padrão /tmp/painel-despejo).
+    Se estiver em um sistema de arquivos em memória (tmpfs, como o /tmp do
+    Cloud Run), os arquivos não são gravados, já que ocupariam a própria RAM.
+"""
+import math
+import os
+import shutil
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+MODO_COMPLETO = "completo"
+MODO_PARTICIONADO = "particionado"
+
+BYTES_POR_LINHA = int(os.getenv("MEMORIA_BYTES_POR_LINHA", "1500"))
+AMOSTRA_LINHAS = int(os.getenv("MEMORIA_AMOSTRA_LINHAS", "50000"))
+BUSCA_MAX_LINHAS = int(os.getenv("MEMORIA_BUSCA_MAX_LINHAS", "5000"))
+DIRETORIO_DESPEJO = os.getenv("MEMORIA_DIR", "/tmp/painel-despejo")
+
+# Cada partição usa no máximo esta fração do orçamento, deixando folga para
+# o Resumo Financeiro acumulado, a amostra e a própria interface.
+FRACAO_POR_PARTICAO = 0.5
+
+_CAMINHOS_LIMITE_CGROUP = (
+    "/sys/fs/cgroup/memory.max",                    # cgroup v2
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+)
+
+
+def limite_memoria_conteiner() -> Optional[int]:
+    """
+    Limite de memória do contêiner em bytes (cgroup), ou None se não houver limite.
+    """
+    for caminho in _CAMINHOS_LIMITE_CGROUP:
+        try:
+            with open(caminho) as arquivo:
+                valor = arquivo.read().strip()
+        except OSError:
+            continue
+        # "max" (v2) ou um número absurdo (v1) significam "sem limite"
+        if valor.isdigit() and int(valor) < 1 << 60:
+            return int(valor)
+    return None
+
+
+def _tipo_sistema_arquivos(diretorio: str) -> Optional[str]:
+    """
+    Tipo do sistema de arquivos (ex.: "ext4", "tmpfs") que contém o diretório,
+    segundo /proc/mounts. None se não for possível determinar.
+    """
+    caminho = os.path.realpath(diretorio)
+    melhor, tipo = "", None
+    try:
+        with open("/proc/mounts") as arquivo:
+            for linha in arquivo:
+                partes = linha.split()
+                if len(partes) < 3:
+                    continue
+                ponto = partes[1]
+                dentro = caminho == ponto or caminho.startswith(ponto.rstrip("/") + "/")
+                if dentro and len(ponto) >= len(melhor):
+                    melhor, tipo = ponto, partes[2]
+    except OSError:
+        return None
+    return tipo
+
+
+def em_memoria(diretorio: str) -> bool:
+    """
+    True se o diretório fica em um sistema de arquivos em memória (tmpfs/ramfs),
+    como o /tmp do Cloud Run: gravar nele ocupa a própria RAM da instância.
+    """
+    return _tipo_sistema_arquivos(diretorio) in ("tmpfs", "ramfs")
+
+
+@lru_cache(maxsize=None)
+def despejo_em_disco() -> bool:
+    """
+    True se MEMORIA_DIR fica em disco de verdade, e não em tmpfs/ramfs.
+    """
+    return not em_memoria(DIRETORIO_DESPEJO)
+
+
+def orcamento_bytes() -> int:
+    """
+    Orçamento de memória para os dados, em bytes.
+    """
+    configurado = os.getenv("MEMORIA_ORCAMENTO_MB")
+    if configurado:
+        return int(configurado) * 1024 * 1024
+    limite = limite_memoria_conteiner()
+    if limite:
+        return limite // 2
+    return 2048 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class PlanoMemoria:
+    modo: str
+    linhas_estimadas: int
+    bytes_estimados: int
+    orcamento: int
+    particoes: int = 1
+    linhas_por_particao: int = 0  # 0 no modo completo
+
+    def descricao(self) -> str:
+        """
+        Texto curto para a interface.
+        """
+        estimado_mb = self.bytes_estimados / (1024 * 1024)
+        orcamento_mb = self.orcamento / (1024 * 1024)
+        texto = (
+            f"~{self.linhas_estimadas:,} linhas, ~{estimado_mb:,.0f} MB estimados "
+            f"para um orçamento de {orcamento_mb:,.0f} MB"
+        )
+        if self.modo == MODO_PARTICIONADO:
+            texto += (
+                f", processados em ~{self.particoes} partições "
+                f"de até ~{self.linhas_por_particao:,} linhas"
+            )
+        return texto
+
+
+def planejar(linhas_estimadas: int) -> PlanoMemoria:
+    """
+    Decide o modo de carga a partir da estimativa de linhas.
+    """
+    estimado = linhas_estimadas * BYTES_POR_LINHA
+    orcamento = orcamento_bytes()
+    if estimado <= orcamento:
+        return PlanoMemoria(MODO_COMPLETO, linhas_estimadas, estimado, orcamento)
+
+    # O tamanho das partições vem do orçamento, e não da estimativa, que pode
+    # errar: a quantidade de partições é só uma previsão.
+    particoes = math.ceil(estimado / (orcamento * FRACAO_POR_PARTICAO))
+    linhas_por_particao = max(1, int(orcamento * FRACAO_POR_PARTICAO) // BYTES_POR_LINHA)
+    return PlanoMemoria(
+        MODO_PARTICIONADO, linhas_estimadas, estimado, orcamento, particoes, linhas_por_particao
+    )
+
+
+class Amostra:
+    """
+    Amostra uniforme de no máximo `tamanho` linhas de um conjunto lido em
+    partições: cada linha recebe uma chave aleatória e ficam as de menores
+    chaves. O tamanho depende só das linhas de fato lidas (e não da estimativa
+    do planejador), e nunca passa de `tamanho`.
+    """
+
+    def __init__(self, tamanho: int = AMOSTRA_LINHAS, semente: int = 0):
+        self.tamanho = tamanho
+        self._gerador = np.random.default_rng(semente)
+        self._linhas: Optional[pd.DataFrame] = None
+        self._chaves = np.empty(0)
+
+    def incluir(self, df: pd.DataFrame) -> None:
+        # Primeiro as candidatas da partição, para não copiar a partição inteira
+        linhas, chaves = self._menores(df, self._gerador.random(len(df)))
+        if self._linhas is not None:
+            linhas = pd.concat([self._linhas, linhas], ignore_index=True)
+            chaves = np.concatenate([self._chaves, chaves])
+        self._linhas, self._chaves = self._menores(linhas, chaves)
+
+    def _menores(self, linhas: pd.DataFrame, chaves: np.ndarray):
+        if len(linhas) > self.tamanho:
+            escolhidas = np.sort(np.argpartition(chaves, self.tamanho)[:self.tamanho])
+            linhas, chaves = linhas.iloc[escolhidas], chaves[escolhidas]
+        return linhas.reset_index(drop=True), chaves
+
+    def resultado(self) -> pd.DataFrame:
+        return self._linhas if self._linhas is not None else pd.DataFrame()
+
+
+class Despejo:
+    """
+    Conjunto de DataFrames gravados em disco como arquivos Arrow (IPC),
+    lidos de volta por mapeamento de memória.
+    """
+
+    def __init__(self, nome: str):
+        self.diretorio = os.path.join(DIRETORIO_DESPEJO, nome)
+
+    def limpar(self) -> None:
+        """
+        Esvazia o diretório deste conjunto e remove os de versões anteriores.
+        """
+        if os.path.isdir(DIRETORIO_DESPEJO):
+            for nome in os.listdir(DIRETORIO_DESPEJO):
+                shutil.rmtree(os.path.join(DIRETORIO_DESPEJO, nome), ignore_errors=True)
+        os.makedirs(self.diretorio, exist_ok=True)
+
+    def _caminhos(self) -> List[str]:
+        if not os.path.isdir(self.diretorio):
+            return []
+        return sorted(
+            os.path.join(self.diretorio, nome)
+            for nome in os.listdir(self.diretorio)
+            if nome.endswith(".arrow")
+        )
+
+    def gravar(self, nome: str, df: pd.DataFrame) -> None:
+        """
+        Grava o DataFrame sem compressão, para permitir leitura mapeada em memória.
+        """
+        import pyarrow.feather as feather
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        caminho = os.path.join(self.diretorio, f"{nome}.arrow")
+        feather.write_feather(df.reset_index(drop=True), caminho + ".tmp", compression="uncompressed")
+        os.replace(caminho + ".tmp", caminho)
+
+    def buscar(self, coluna: str, trecho: str, limite: int = BUSCA_MAX_LINHAS) -> pd.DataFrame:
+        """
+        Até `limite` linhas, de todos os arquivos, em que `coluna` (como texto)
+        contém `trecho`. Os arquivos são percorridos bloco a bloco e a leitura
+        para ao atingir o limite, então um trecho curto (ex.: "1") não traz o
+        conjunto inteiro para a memória. Só as linhas encontradas viram pandas.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        partes = []
+        restante = limite
+        for caminho in self._caminhos():
+            with pa.memory_map(caminho) as fonte:
+                leitor = pa.ipc.open_file(fonte)
+                for indice in range(leitor.num_record_batches):
+                    bloco = leitor.get_batch(indice)
+                    valores = pc.cast(bloco.column(coluna), pa.string())
+                    encontrados = bloco.filter(pc.fill_null(pc.match_substring(valores, trecho), False))
+                    if encontrados.num_rows:
+                        encontrados = encontrados.slice(0, restante)
+                        partes.append(encontrados.to_pandas())
+                        restante -= encontrados.num_rows
+                    if restante <= 0:
+                        break
+            if restante <= 0:
+                break
+        if not partes:
+            return pd.DataFrame()
+        return pd.concat(partes, ignore_index=True)
@@ -0,0 +1,129 @@
+"""
+Preparação dos dados do painel, cacheada no processo por versão dos dados.
+
+Fica fora de `stream.py` porque o Streamlit identifica as funções cacheadas
+pelo módulo em que foram definidas: o script roda como `__main__` a cada rerun,
+e só um módulo importado normalmente é o mesmo para o script e para o
+aquecimento (`aquecimento.py`), que preenche estes caches antes da primeira sessão.
+"""
+import os
+import time
+from typing import Tuple
+
+import pandas as pd
+import streamlit as st
+
+import memoria
+import regras
+from cache import obter_cache
+from conciliacao import calcular_situacao_pedidos, verificar_descontar_retroativo
+from dados import ler_dados_geral, ler_dados_geral_em_blocos, estimar_linhas_dados
+
+# Versão dos dados usada nas chaves de cache (local e compartilhado).
+# CACHE_VERSAO permite invalidar tudo manualmente; CACHE_TTL define a janela de validade.
+CACHE_VERSAO = os.getenv("CACHE_VERSAO", "1")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+
+
+def versao_dados() -> str:
+    """
+    Retorna a chave de versão dos dados: muda quando CACHE_VERSAO é alterada
+    ou quando começa uma nova janela de CACHE_TTL segundos. Todas as instâncias
+    calculam a mesma chave para o mesmo instante, o que permite compartilhar o cache.
+    """
+    janela = int(time.time() // CACHE_TTL)
+    return f"v{CACHE_VERSAO}-{janela}"
+
+
+def carregar_dados_geral(versao: str) -> pd.DataFrame:
+    """
+    Versão cacheada de `ler_dados_geral`: busca no cache compartilhado entre
+    instâncias e só consulta o banco se a versão ainda não estiver lá.
+    (O modo de memória particionado lê o banco diretamente: o cache guardaria
+    todas as partições, e com CACHE_DIR em /tmp isso ocuparia a própria RAM.)
+    """
+    return obter_cache().obter_ou_calcular(f"dados_geral:{versao}", ler_dados_geral)
+
+
+@st.cache_resource(max_entries=2)
+def preparar_dados(versao: str) -> pd.DataFrame:
+    """
+    Carrega os dados da versão informada e aplica as regras de conciliação,
+    que não dependem dos filtros da tela. O resultado fica no st.cache_resource, então
+    os reruns da mesma versão não repetem nenhum desses passos. Ao contrário do
+    st.cache_data, o mesmo objeto é devolvido a todas as sessões, sem uma cópia
+    por rerun: o DataFrame retornado é somente leitura.
+    """
+    df = carregar_dados_geral(versao)
+
+    # Todas as regras do marketplace de cada linha, avaliadas de uma vez:
+    # erro_comissao, erro_descontar, erro_descontar_retroativo, codigo_erros e lista_erros
+    return df.join(regras.aplicar_regras(df))
+
+
+@st.cache_resource(max_entries=2)
+def preparar_retroativo(versao: str) -> pd.DataFrame:
+    """
+    Resumo de `verificar_descontar_retroativo` de todos os pedidos da versão
+    (modo de memória completo). Somente leitura, como o resultado de `preparar_dados`.
+    """
+    return verificar_descontar_retroativo(preparar_dados(versao))
+
+
+@st.cache_resource(max_entries=2)
+def planejar_memoria(versao: str) -> memoria.PlanoMemoria:
+    """
+    Modo de carga da versão (completo ou particionado), decidido pela
+    estimativa de tamanho antes de carregar qualquer dado.
+    """
+    return memoria.planejar(estimar_linhas_dados())
+
+
+@st.cache_resource(max_entries=2)
+def preparar_dados_particionado(
+    versao: str, linhas_por_particao: int
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, int]:
+    """
+    Equivalente de `preparar_dados` quando os dados não cabem no orçamento de
+    memória. Os dados são lidos do banco em uma única consulta (sem passar pelo
+    cache compartilhado), em partições de cerca de `linhas_por_particao` linhas
+    que não dividem pedidos (ver `ler_dados_geral_em_blocos`). Cada partição
+    recebe as regras e o cálculo por pedido, é gravada em disco como arquivo
+    Arrow, se MEMORIA_DIR estiver de fato em disco (ver
+    `memoria.despejo_em_disco`), e liberada. Retorna:
+      - uma amostra das linhas (até memoria.AMOSTRA_LINHAS), para as abas de linhas
+      - o resultado de `calcular_situacao_pedidos` de todos os pedidos
+      - o resultado de `verificar_descontar_retroativo` de todos os pedidos
+      - o total de linhas
+    """
+    despejo = memoria.Despejo(versao) if memoria.despejo_em_disco() else None
+    if despejo is not None:
+        despejo.limpar()
+
+    amostra = memoria.Amostra()
+    situacoes = []
+    retroativos = []
+    total_linhas = 0
+    for indice, df in enumerate(ler_dados_geral_em_blocos(linhas_por_particao)):
+        df = df.join(regras.aplicar_regras(df))
+        total_linhas += len(df)
+        situacoes.append(calcular_situacao_pedidos(df))
+        retroativos.append(verificar_descontar_retroativo(df))
+        amostra.incluir(df)
+        if despejo is not None:
+            despejo.gravar(f"particao_{indice:04d}", df)
+        del df
+
+    situacao = pd.concat(situacoes, ignore_index=True)
+    retroativo = pd.concat(retroativos, ignore_index=True)
+    return amostra.resultado(), situacao, retroativo, total_linhas
+
+
+@st.cache_data(max_entries=32, ttl=CACHE_TTL)
+def buscar_pedido_particionado(versao: str, pedido: str) -> pd.DataFrame:
+    """
+    Linhas (não só as da amostra) dos pedidos que contêm `pedido`, lidas dos
+    arquivos Arrow gravados por `preparar_dados_particionado`, limitadas a
+    memoria.BUSCA_MAX_LINHAS. O cache guarda poucas buscas, por tempo limitado.
+    """
+    return memoria.Despejo(versao).buscar("numero_pedido", pedido)
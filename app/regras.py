@@ -0,0 +1,518 @@
+"""
+Regras de conciliação declarativas, por marketplace.
+
+Cada marketplace é descrito por uma `ConfigMarketplace`:
+  - aliases_evento: variações de texto do tipo de evento => evento padronizado
+  - agregados: valores por pedido calculados sobre as linhas de um evento
+  - regras: expressões vetorizadas que marcam erros (por linha ou por pedido)
+  - tolerancias: constantes (em centavos) disponíveis nas expressões
+  - papeis_resumo: papel de cada evento no Resumo Financeiro
+  - situacoes_pagamento/situacoes_finais: condições, por pedido, de cada
+    situação do Resumo Financeiro (vale a primeira verdadeira)
+
+As expressões são strings Python sobre colunas (arrays numpy inteiros, em
+centavos/pontos-base) e são compiladas uma única vez; a avaliação marca todas
+as regras de uma vez sobre as colunas inteiras, sem laços por linha.
+Para incluir um marketplace novo basta acrescentar uma configuração em
+`CONFIGURACOES`. Marketplaces sem configuração usam `CONFIG_PADRAO`.
+
+Funções disponíveis nas expressões: abs, isnull, existe (= não nulo).
+Use `&`, `|` e `~` (com parênteses) para combinar condições.
+"""
+import ast
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DESCONHECIDO = "Desconhecido"  # evento vazio
+OUTROS = "Outros"              # evento fora do mapeamento
+
+
+@dataclass(frozen=True)
+class Agregado:
+    """
+    Valor por pedido: `funcao` ("first", "last", "sum", "max", "min") aplicada
+    à `coluna` das linhas do `evento`. Pedidos sem o evento ficam nulos.
+    """
+    nome: str
+    coluna: str
+    evento: str
+    funcao: str
+
+
+@dataclass(frozen=True)
+class Regra:
+    """
+    Uma verificação de conciliação.
+      - rotulo: nome do erro (entra em `lista_erros` se na_lista_erros=True)
+      - expressao: condição que caracteriza o erro
+      - evento: se informado, a regra só vale nas linhas deste evento
+      - por_pedido: a expressão usa os agregados do pedido e o resultado vale
+        para todas as linhas do pedido
+      - coluna/valor: coluna de marcação preenchida com `valor` onde há erro
+    """
+    rotulo: str
+    expressao: str
+    evento: Optional[str] = None
+    por_pedido: bool = False
+    coluna: Optional[str] = None
+    valor: str = "ERRO"
+    na_lista_erros: bool = True
+
+
+@dataclass(frozen=True)
+class Situacao:
+    """
+    Situação do Resumo Financeiro: vale `nome` para os pedidos em que
+    `expressao` é verdadeira. A expressão usa os valores do pedido em centavos
+    (valor_total, comissao_esperada, valor_a_receber, valor_recebido,
+    valor_hove, valor_retro, valor_descontado, desconto_frete) e as tolerâncias.
+    """
+    nome: str
+    expressao: str
+
+
+@dataclass(frozen=True)
+class ConfigMarketplace:
+    nome: str
+    marketplaces: Tuple[str, ...]       # valores de `marketplace` (mk.nome), em minúsculas
+    eventos: Tuple[str, ...]            # eventos padronizados, na ordem de exibição
+    aliases_evento: Dict[str, str]
+    agregados: Tuple[Agregado, ...]
+    regras: Tuple[Regra, ...]
+    tolerancias: Dict[str, int]
+    papeis_resumo: Dict[str, str] = field(default_factory=dict)
+    # Em ordem: vale a primeira situação verdadeira; sem nenhuma, o padrão
+    situacoes_pagamento: Tuple[Situacao, ...] = ()
+    situacao_pagamento_padrao: str = "nao pago"
+    # Em ordem; sem nenhuma, a situação final é a situação do pagamento
+    situacoes_finais: Tuple[Situacao, ...] = ()
+
+
+# =========================================================================
+# 1. Configurações
+# =========================================================================
+
+REPASSE_NORMAL = "Repasse Normal"
+DESCONTAR_HOVE = "Descontar Hove/Houve"
+DESCONTAR_REVERSA = "Descontar Reversa Centauro Envios"
+DESCONTAR_RETROATIVO = "Descontar Retroativo"
+AJUSTE_CICLO = "Ajuste de Ciclo"
+
+CENTAURO = ConfigMarketplace(
+    nome="Centauro",
+    marketplaces=("centauro",),
+    eventos=(
+        REPASSE_NORMAL,
+        DESCONTAR_HOVE,
+        DESCONTAR_REVERSA,
+        DESCONTAR_RETROATIVO,
+        AJUSTE_CICLO,
+    ),
+    aliases_evento={
+        "repasse normal": REPASSE_NORMAL,
+        "repasse - normal": REPASSE_NORMAL,
+        "repassse normal": REPASSE_NORMAL,
+        "repassse - normal": REPASSE_NORMAL,
+
+        "descontar hove": DESCONTAR_HOVE,
+        "descontar houve": DESCONTAR_HOVE,
+        "descontar - houve": DESCONTAR_HOVE,
+        "descontar - hove": DESCONTAR_HOVE,
+
+        "descontar reversa centauro envios": DESCONTAR_REVERSA,
+        "descontar - reversa centauro envios": DESCONTAR_REVERSA,
+
+        "ajuste de ciclo": AJUSTE_CICLO,
+
+        "descontar retroativo": DESCONTAR_RETROATIVO,
+        "descontar - retroativo": DESCONTAR_RETROATIVO,
+        "descontar retroativo sac": DESCONTAR_RETROATIVO,
+        "descontar - retroativo sac": DESCONTAR_RETROATIVO,
+        "descontar retroativos": DESCONTAR_RETROATIVO,
+        "descontar - retroativos": DESCONTAR_RETROATIVO,
+        "descontar retroativos sac": DESCONTAR_RETROATIVO,
+        "descontar - retroativos sac": DESCONTAR_RETROATIVO,
+    },
+    agregados=(
+        Agregado("repasse_liquido", "valor_liquido_centavos", REPASSE_NORMAL, "last"),
+        Agregado("hove_final", "valor_final_centavos", DESCONTAR_HOVE, "last"),
+        Agregado("retro_liquido", "valor_liquido_centavos", DESCONTAR_RETROATIVO, "first"),
+        Agregado("retro_soma", "valor_final_centavos", DESCONTAR_RETROATIVO, "sum"),
+    ),
+    regras=(
+        # Valor final negativo não deveria ocorrer em um repasse normal
+        Regra("Valor Final Negativo", "valor_final_centavos < 0", evento=REPASSE_NORMAL),
+        # Porcentagem = 0 significa que não há comissão configurada
+        Regra("Falta de Comissão", "porcentagem_pb == 0", evento=REPASSE_NORMAL),
+        Regra("Falta de Data de Comissão", "isnull(data_comissao)", evento=REPASSE_NORMAL),
+        # valor_final deve ser valor_liquido - comissão (sem porcentagem não há como verificar)
+        Regra(
+            "Erro Cálculo Comissão",
+            "(porcentagem_pb != 0)"
+            " & (abs(valor_liquido_centavos - comissao_centavos - valor_final_centavos) > comissao)",
+            evento=REPASSE_NORMAL,
+            coluna="erro_comissao",
+        ),
+        # O "Descontar Hove/Houve" deve devolver exatamente o valor do Repasse Normal
+        Regra(
+            "Erro Devolução",
+            "existe(repasse_liquido) & existe(hove_final) & (abs(repasse_liquido) != abs(hove_final))",
+            por_pedido=True,
+            coluna="erro_descontar",
+            valor="ERRO_DEVOLUCAO",
+        ),
+        # A soma dos "Descontar Retroativo" não deveria ser o valor inteiro do pedido
+        Regra(
+            "Erro Descontar Retroativo",
+            "existe(retro_soma) & (abs(retro_soma) == abs(retro_liquido)) & (retro_liquido != 0)",
+            por_pedido=True,
+            coluna="erro_descontar_retroativo",
+            valor="ERRO_DESCONTAR_RETROATIVO",
+        ),
+    ),
+    tolerancias={
+        "comissao": 5,  # R$0,05
+        "pago": 5,      # R$0,05 => "pago"
+        "correta": 1,   # R$0,01 => "Correta"
+    },
+    papeis_resumo={
+        REPASSE_NORMAL: "recebido",
+        DESCONTAR_HOVE: "devolucao",
+        DESCONTAR_RETROATIVO: "retroativo",
+        DESCONTAR_REVERSA: "frete",
+    },
+    situacoes_pagamento=(
+        Situacao("pago", "abs(valor_recebido - valor_a_receber) < pago"),
+        Situacao("pago a maior", "valor_recebido > valor_a_receber"),
+        Situacao("pago a menor", "valor_recebido > 0"),
+    ),
+    situacao_pagamento_padrao="nao pago",
+    situacoes_finais=(
+        # O "Descontar Hove/Houve" deve devolver exatamente o valor total do pedido
+        Situacao("Erro Devolução", "(valor_hove != 0) & (abs(valor_hove) != abs(valor_total))"),
+        Situacao("Correta", "abs(valor_recebido - valor_a_receber) < correta"),
+    ),
+)
+
+CONFIGURACOES = {config.nome: config for config in [CENTAURO]}
+
+# Hoje todos os eventos vêm de `evento_centauro`, então as regras da Centauro
+# valem para qualquer marketplace sem configuração própria.
+CONFIG_PADRAO = CENTAURO
+
+
+# =========================================================================
+# 2. Compilação
+# =========================================================================
+
+FUNCOES = {
+    "abs": np.abs,
+    "isnull": pd.isnull,
+    "existe": lambda valores: ~pd.isnull(valores),
+}
+
+_NOS_PERMITIDOS = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call,
+    ast.Name, ast.Load, ast.Constant, ast.operator, ast.unaryop, ast.cmpop,
+)
+
+
+@dataclass(frozen=True)
+class RegraCompilada:
+    regra: Regra
+    codigo: object
+    nomes: Tuple[str, ...]  # colunas/agregados/tolerâncias usados na expressão
+
+
+def compilar_expressao(expressao: str) -> Tuple[object, Tuple[str, ...]]:
+    """
+    Valida e compila uma expressão. Só são aceitos nomes, constantes,
+    operadores e chamadas às funções de `FUNCOES` (`and`/`or` não funcionam
+    com arrays; use `&`/`|`).
+    """
+    arvore = ast.parse(expressao, mode="eval")
+    nomes = []
+    for no in ast.walk(arvore):
+        if not isinstance(no, _NOS_PERMITIDOS):
+            raise ValueError(f"Construção não permitida na regra {expressao!r}: {type(no).__name__}")
+        if isinstance(no, ast.Call) and not (isinstance(no.func, ast.Name) and no.func.id in FUNCOES):
+            raise ValueError(f"Função não permitida na regra {expressao!r}")
+        if isinstance(no, ast.Name) and no.id not in FUNCOES and no.id not in nomes:
+            nomes.append(no.id)
+    return compile(arvore, f"<regra {expressao}>", "eval"), tuple(nomes)
+
+
+@lru_cache(maxsize=None)
+def compilar(nome_config: str) -> Tuple[RegraCompilada, ...]:
+    """
+    Compila (uma vez por processo) as regras de uma configuração.
+    """
+    config = CONFIGURACOES[nome_config]
+    compiladas = []
+    for regra in config.regras:
+        codigo, nomes = compilar_expressao(regra.expressao)
+        compiladas.append(RegraCompilada(regra, codigo, nomes))
+    return tuple(compiladas)
+
+
+@dataclass(frozen=True)
+class SituacaoCompilada:
+    situacao: Situacao
+    codigo: object
+    nomes: Tuple[str, ...]
+
+
+@lru_cache(maxsize=None)
+def compilar_situacoes(nome_config: str) -> Tuple[Tuple[SituacaoCompilada, ...], Tuple[SituacaoCompilada, ...]]:
+    """
+    Compila (uma vez por processo) as situações de pagamento e finais de uma configuração.
+    """
+    config = CONFIGURACOES[nome_config]
+    return tuple(
+        tuple(SituacaoCompilada(s, *compilar_expressao(s.expressao)) for s in situacoes)
+        for situacoes in (config.situacoes_pagamento, config.situacoes_finais)
+    )
+
+
+def _avaliar(compilada: RegraCompilada, colunas: dict) -> np.ndarray:
+    """
+    Avalia a expressão sobre as colunas informadas (nome => array), retornando uma máscara booleana.
+    """
+    ambiente = {nome: colunas[nome] for nome in compilada.nomes}
+    resultado = eval(compilada.codigo, {"__builtins__": {}, **FUNCOES}, ambiente)
+    return np.asarray(resultado, dtype=bool)
+
+
+# =========================================================================
+# 3. Aplicação
+# =========================================================================
+
+def config_por_linha(marketplaces: pd.Series) -> pd.Series:
+    """
+    Nome da configuração aplicável a cada linha, a partir da coluna `marketplace`.
+    """
+    por_nome = {
+        nome_mk: config.nome
+        for config in CONFIGURACOES.values()
+        for nome_mk in config.marketplaces
+    }
+    chave = marketplaces.fillna("").astype(str).str.strip().str.lower()
+    return chave.map(por_nome).fillna(CONFIG_PADRAO.nome)
+
+
+def normalizar_eventos(df: pd.DataFrame) -> pd.Series:
+    """
+    Converte as variações de `tipo_evento` no evento padronizado do marketplace
+    de cada linha. Eventos vazios => "Desconhecido"; fora do mapeamento => "Outros".
+    """
+    chave = df["tipo_evento"].fillna("").astype(str).str.strip().str.lower()
+    configs = config_por_linha(df["marketplace"])
+
+    resultado = pd.Series(OUTROS, index=df.index, dtype=object)
+    for nome in configs.unique():
+        linhas = configs == nome
+        resultado[linhas] = chave[linhas].map(CONFIGURACOES[nome].aliases_evento).fillna(OUTROS)
+    resultado[chave == ""] = DESCONHECIDO
+    return resultado
+
+
+def eventos_padronizados() -> List[str]:
+    """
+    Todos os eventos padronizados (para filtros), na ordem das configurações.
+    """
+    eventos = []
+    for config in CONFIGURACOES.values():
+        eventos.extend(e for e in config.eventos if e not in eventos)
+    return eventos + [OUTROS, DESCONHECIDO]
+
+
+def rotulos_erro() -> List[str]:
+    """
+    Rótulos que podem aparecer em `lista_erros`. A posição de cada rótulo
+    é o bit correspondente na coluna `codigo_erros`.
+    """
+    rotulos = []
+    for config in CONFIGURACOES.values():
+        rotulos.extend(
+            r.rotulo for r in config.regras
+            if r.na_lista_erros and r.rotulo not in rotulos
+        )
+    return rotulos
+
+
+def colunas_marcacao() -> List[str]:
+    """
+    Colunas de marcação criadas pelas regras (ex.: erro_comissao, erro_descontar).
+    """
+    colunas = []
+    for config in CONFIGURACOES.values():
+        colunas.extend(r.coluna for r in config.regras if r.coluna and r.coluna not in colunas)
+    return colunas
+
+
+def agregar_pedidos(df: pd.DataFrame, config: ConfigMarketplace) -> pd.DataFrame:
+    """
+    DataFrame indexado por numero_pedido com os agregados da configuração.
+    """
+    tipo = df["tipo_evento_normalizado"]
+    partes = {}
+    for agregado in config.agregados:
+        linhas = df.loc[tipo == agregado.evento, ["numero_pedido", agregado.coluna]]
+        partes[agregado.nome] = linhas.groupby("numero_pedido")[agregado.coluna].agg(agregado.funcao)
+    return pd.DataFrame(partes)
+
+
+def aplicar_regras(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Avalia todas as regras sobre o DataFrame (que já deve ter as colunas em
+    centavos e `tipo_evento_normalizado`) e devolve um DataFrame, com o mesmo
+    índice, contendo:
+      - as colunas de marcação (erro_comissao, erro_descontar, ...)
+      - codigo_erros: bits dos rótulos encontrados (ver `rotulos_erro`)
+      - lista_erros: lista com os rótulos encontrados
+    """
+    rotulos = rotulos_erro()
+    bits = np.zeros(len(df), dtype="int64")
+    marcacoes = {coluna: np.full(len(df), "", dtype=object) for coluna in colunas_marcacao()}
+
+    configs = config_por_linha(df["marketplace"]).to_numpy()
+    tipo = df["tipo_evento_normalizado"].to_numpy()
+    pedidos = df["numero_pedido"]
+
+    for nome in pd.unique(configs):
+        config = CONFIGURACOES[nome]
+        linhas = configs == nome
+
+        # Colunas da linha e agregados do pedido, obtidos uma vez por configuração
+        colunas_linha = _Colunas(df, config.tolerancias)
+        agregados = None
+
+        for compilada in compilar(nome):
+            regra = compilada.regra
+            if regra.por_pedido:
+                if agregados is None:
+                    df_pedidos = agregar_pedidos(df[linhas], config)
+                    agregados = _Colunas(df_pedidos, config.tolerancias)
+                por_pedido = pd.Series(_avaliar(compilada, agregados), index=df_pedidos.index)
+                resultado = pedidos.map(por_pedido).eq(True).to_numpy()
+            else:
+                resultado = _avaliar(compilada, colunas_linha)
+
+            mascara = linhas & resultado
+            if regra.evento:
+                mascara &= tipo == regra.evento
+
+            if regra.coluna:
+                marcacoes[regra.coluna][mascara] = regra.valor
+            if regra.na_lista_erros:
+                bits[mascara] |= 1 << rotulos.index(regra.rotulo)
+
+    resultado = pd.DataFrame(marcacoes, index=df.index)
+    resultado["codigo_erros"] = bits
+    resultado["lista_erros"] = listas_de_erros(resultado["codigo_erros"], rotulos)
+    return resultado
+
+
+def mascara_erros(codigo_erros: pd.Series, erros: List[str]) -> pd.Series:
+    """
+    True nas linhas que têm ao menos um dos erros informados.
+    """
+    rotulos = rotulos_erro()
+    bits = 0
+    for erro in erros:
+        if erro in rotulos:
+            bits |= 1 << rotulos.index(erro)
+    return (codigo_erros & bits) != 0
+
+
+def situacoes_resumo() -> List[str]:
+    """
+    Todas as situações finais possíveis (para filtros), na ordem das configurações.
+    """
+    situacoes = []
+    for config in CONFIGURACOES.values():
+        nomes = [s.nome for s in config.situacoes_finais + config.situacoes_pagamento]
+        nomes.append(config.situacao_pagamento_padrao)
+        situacoes.extend(n for n in nomes if n not in situacoes)
+    return situacoes
+
+
+def classificar_situacoes(pedidos: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Situação do pagamento e situação final de cada pedido (uma linha por
+    pedido, com `marketplace` e os valores do Resumo Financeiro em centavos),
+    conforme as situações da configuração do marketplace.
+    """
+    pagamento = np.empty(len(pedidos), dtype=object)
+    final = np.empty(len(pedidos), dtype=object)
+    configs = config_por_linha(pedidos["marketplace"]).to_numpy()
+
+    for nome in pd.unique(configs):
+        config = CONFIGURACOES[nome]
+        linhas = configs == nome
+        colunas = _Colunas(pedidos[linhas], config.tolerancias)
+        compiladas_pagamento, compiladas_finais = compilar_situacoes(nome)
+
+        situacao_pag = np.full(linhas.sum(), config.situacao_pagamento_padrao, dtype=object)
+        if compiladas_pagamento:
+            situacao_pag = np.select(
+                [_avaliar(c, colunas) for c in compiladas_pagamento],
+                [c.situacao.nome for c in compiladas_pagamento],
+                default=situacao_pag,
+            )
+        situacao_final = situacao_pag
+        if compiladas_finais:
+            situacao_final = np.select(
+                [_avaliar(c, colunas) for c in compiladas_finais],
+                [c.situacao.nome for c in compiladas_finais],
+                default=situacao_pag,
+            )
+        pagamento[linhas] = situacao_pag
+        final[linhas] = situacao_final
+    return pagamento, final
+
+
+def papel_evento(df: pd.DataFrame) -> pd.Series:
+    """
+    Papel de cada linha no Resumo Financeiro ("recebido", "devolucao",
+    "retroativo", "frete"), conforme a configuração do marketplace. Nulo se nenhum.
+    """
+    configs = config_por_linha(df["marketplace"])
+    tipo = df["tipo_evento_normalizado"]
+    papel = pd.Series(None, index=df.index, dtype=object)
+    for nome in configs.unique():
+        linhas = configs == nome
+        papel[linhas] = tipo[linhas].map(CONFIGURACOES[nome].papeis_resumo)
+    return papel
+
+
+class _Colunas(dict):
+    """
+    Colunas como arrays numpy, convertidas sob demanda, mais as tolerâncias.
+    """
+
+    def __init__(self, df: pd.DataFrame, constantes: Dict[str, int]):
+        super().__init__(constantes)
+        self._df = df
+
+    def __missing__(self, nome):
+        valores = self._df[nome].to_numpy()
+        self[nome] = valores
+        return valores
+
+
+def listas_de_erros(codigos: pd.Series, rotulos: List[str]) -> pd.Series:
+    """
+    Converte os bits de `codigo_erros` em listas de rótulos. Como há poucas combinações
+    distintas, montamos uma lista por combinação (compartilhada entre as
+    linhas, que não devem alterá-la) e não por linha.
+    """
+    tabela = pd.Series({
+        int(codigo): [r for i, r in enumerate(rotulos) if int(codigo) >> i & 1]
+        for codigo in np.unique(codigos.to_numpy())
+    }, dtype=object)
+    return codigos.map(tabela)
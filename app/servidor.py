@@ -0,0 +1,28 @@
+"""
+Ponto de entrada do contêiner: aquece a instância e inicia o Streamlit no
+mesmo processo, para que a engine e os caches preenchidos pelo aquecimento
+sejam os mesmos usados pelas sessões.
+
+Uso (os argumentos são repassados ao `streamlit run app/stream.py`):
+
+    python app/servidor.py --server.port=8501 --server.address=0.0.0.0
+"""
+import logging
+import os
+import sys
+import time
+
+from aquecimento import iniciar_aquecimento, registrar_tempo
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    iniciar_aquecimento()
+
+    # O aquecimento já importou o streamlit; se falhou antes disso, o import acontece aqui
+    inicio = time.perf_counter()
+    from streamlit.web import cli
+    registrar_tempo("Import do servidor Streamlit", time.perf_counter() - inicio)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stream.py")
+    sys.argv = ["streamlit", "run", script, *sys.argv[1:]]
+    sys.exit(cli.main())
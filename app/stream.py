@@ -1,319 +1,107 @@
+import time
+import logging
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, text
-import os
+import numpy as np
 from datetime import datetime
-import matplotlib.pyplot as plt  # Para gráficos de pizza/barras
-from dotenv import load_dotenv
+
+from aquecimento import registrar_tempo
+from conciliacao import calcular_situacao_pedidos, verificar_descontar_retroativo
+from dinheiro import para_reais
+from preparo import (
+    versao_dados,
+    planejar_memoria,
+    preparar_dados,
+    preparar_retroativo,
+    preparar_dados_particionado,
+    buscar_pedido_particionado,
+)
+import regras
+import materializacao
+import memoria
 
 # =========================================================================
-# 1. Configurações de Conexão ao Banco
+# 1. Configurações
 # =========================================================================
-load_dotenv()
-
-DB_USER = os.getenv("DB_USER", "")
-DB_PASS = os.getenv("DB_PASSWORD", "")
-DB_HOST = os.getenv("DB_HOST", "")
-DB_PORT = os.getenv("DB_PORT", "")
-DB_NAME = os.getenv("DB_NAME", "")
+# A conexão com o banco (variáveis DB_*) fica em `banco.py`; a engine só é
+# criada na primeira consulta, fora do caminho de import do script. As consultas
+# ficam em `dados.py`, os cálculos por pedido em `conciliacao.py` e a preparação
+# cacheada por versão dos dados (CACHE_VERSAO, CACHE_TTL) em `preparo.py`.
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL, echo=False)
+# As regras de conciliação (eventos, tolerâncias e rótulos de erro) de cada
+# marketplace ficam declaradas em `regras.py`.
 
 # =========================================================================
 # 2. Funções Auxiliares
 # =========================================================================
 
-@st.cache_data
-def carregar_dados_geral():
-    """
-    Lê dados de diversas tabelas do banco:
-    - sku_marketplace (sm)
-    - marketplaces (mk)
-    - comissoes_pedido (cp)
-    - vendas (v)
-    - evento_centauro (ec)
-    
-    Faz um LEFT JOIN para cada tabela, consolidando:
-      - marketplace (nome)
-      - sku_marketplace_id (ligado à tabela `sku_marketplace`)
-      - número do pedido
-      - valor_liquido (do pedido) vem de 'vendas'
-      - data e porcentagem da comissão (de comissoes_pedido)
-      - cálculo da comissão = porcentagem * valor_liquido
-      - tipo de evento e valor_final (repasse_liquido_evento) vindos de 'evento_centauro'
-      - data do pedido (de vendas)
-      - data do repasse (data_ciclo) do evento_centauro
-
-    Depois, preenche valores nulos com zero ou strings vazias,
-    e normaliza o tipo_evento para valores padronizados (Repasse Normal, etc.).
-    Retorna um DataFrame pronto para ser exibido/filtrado.
-    """
-    query = text("""
-        SELECT
-            mk.nome AS marketplace,
-            sm.id AS sku_marketplace_id,
-            sm.numero_pedido,
-
-            -- Valor do pedido (universal) buscado da tabela vendas:
-            COALESCE(v.valor_liquido, 0) AS valor_liquido,
-
-            -- Data e porcentagem da comissão:
-            cp.data AS data_comissao,
-            cp.porcentagem,
-
-            -- Cálculo da comissão baseado no valor de 'vendas':
-            (cp.porcentagem * COALESCE(v.valor_liquido, 0)) AS comissao_calc,
-
-            -- Informações de evento (centauro):
-            ec.tipo_evento,
-            COALESCE(ec.repasse_liquido_evento, 0) AS valor_final,
-            v.data AS data_evento,
-            ec.data_repasse AS data_ciclo
-
-        FROM sku_marketplace sm
-        LEFT JOIN marketplaces mk
-            ON sm.marketplace_id = mk.id
-        LEFT JOIN vendas v
-            ON sm.id = v.sku_marketplace_id
-        LEFT JOIN comissoes_pedido cp
-            ON sm.id = cp.sku_marketplace_id
-        LEFT JOIN evento_centauro ec
-            ON ec.numero_pedido = sm.numero_pedido;
-    """)
-    df = pd.read_sql(query, engine)
-
-    # Preenche valores nulos em colunas-chave
-    df["valor_liquido"] = df["valor_liquido"].fillna(0)
-    df["valor_final"] = df["valor_final"].fillna(0)
-    df["porcentagem"] = df["porcentagem"].fillna(0)
-    df["tipo_evento"] = df["tipo_evento"].fillna("")
-
-    # Cria uma coluna de tipo_evento_normalizado para unificar valores semelhantes.
-    df["tipo_evento_normalizado"] = df["tipo_evento"].apply(normalizar_tipo_evento)
-
-    return df
-
-
-def normalizar_tipo_evento(evento: str) -> str:
-    """
-    Converte diferentes variações de strings de evento em formatos padronizados.
-    Exemplo: "repasse - normal" ou "Repassse Normal" => "Repasse Normal".
-    Se não estiver no mapeamento, retorna "Outros" ou "Desconhecido" se vazio.
-    """
-    if not evento.strip():
-        return "Desconhecido"
-
-    evento = evento.strip().lower()
-    mapping = {
-        "repasse normal": "Repasse Normal",
-        "repasse - normal": "Repasse Normal",
-        "repassse normal": "Repasse Normal",
-        "repassse - normal": "Repasse Normal",
-
-        "descontar hove": "Descontar Hove/Houve",
-        "descontar houve": "Descontar Hove/Houve",
-        "descontar - houve": "Descontar Hove/Houve",
-        "descontar - hove": "Descontar Hove/Houve",
-
-        "descontar reversa centauro envios": "Descontar Reversa Centauro Envios",
-        "descontar - reversa centauro envios": "Descontar Reversa Centauro Envios",
-
-        "ajuste de ciclo": "Ajuste de Ciclo",
-
-        "descontar retroativo": "Descontar Retroativo",
-        "descontar - retroativo": "Descontar Retroativo",
-        "descontar retroativo sac": "Descontar Retroativo",
-        "descontar - retroativo sac": "Descontar Retroativo",
-        "descontar retroativos": "Descontar Retroativo",
-        "descontar - retroativos": "Descontar Retroativo",
-        "descontar retroativos sac": "Descontar Retroativo",
-        "descontar - retroativos sac": "Descontar Retroativo",
-    }
-    return mapping.get(evento, "Outros")
-
-
-def checar_erro_comissao(row: pd.Series) -> str:
-    """
-    Checa se, para eventos de 'Repasse Normal', a diferença
-    entre (valor_liquido - comissão) e valor_final é maior que 0.05.
-    Se for, retorna "ERRO", senão retorna string vazia.
-    """
-    if row["tipo_evento_normalizado"] != "Repasse Normal":
-        return ""
-
-    # Se não houver porcentagem, não conseguimos verificar
-    if pd.isnull(row["porcentagem"]) or row["porcentagem"] == 0:
-        return ""
-
-    # Valor base do pedido:
-    vl_liquido = round(row["valor_liquido"], 2)
-    # Valor efetivamente repassado (evento_centauro):
-    vl_final = round(row["valor_final"], 2)
-    porcent = round(row["porcentagem"], 4)
-
-    # Valor calculado após a comissão:
-    valor_calc = round(vl_liquido - (vl_liquido * porcent), 2)
-
-    # Se a diferença for maior que 5 centavos, consideramos um erro.
-    if abs(valor_calc - vl_final) > 0.05:
-        return "ERRO"
-    else:
-        return ""
-
-
-def checar_erros_adicionais(row: pd.Series) -> list:
-    """
-    Identifica erros adicionais:
-    - Valor final negativo
-    - Falta de comissão
-    - Falta de data de comissão
-    - Se erro_comissao == "ERRO"
-    - Se 'erro_descontar' == "ERRO_DEVOLUCAO"
-
-    Retorna uma lista de erros encontrados.
-    """
-    erros = []
-    if row["tipo_evento_normalizado"] == "Repasse Normal":
-        # Valor final negativo não deveria ocorrer em um repasse normal
-        if row["valor_final"] < 0:
-            erros.append("Valor Final Negativo")
-
-        # Se porcentagem = 0, significa que não há comissão configurada
-        if row["porcentagem"] == 0:
-            erros.append("Falta de Comissão")
-
-        # Se data de comissão não existe, podemos marcar como erro
-        if pd.isnull(row["data_comissao"]):
-            erros.append("Falta de Data de Comissão")
-
-        # Se a checagem de comissão detectou erro
-        if row["erro_comissao"] == "ERRO":
-            erros.append("Erro Cálculo Comissão")
-
-    # Se a verificação de "Descontar Hove/Houve" detectou divergência
-    if "erro_descontar" in row and row["erro_descontar"] == "ERRO_DEVOLUCAO":
-        erros.append("Erro Devolução")
-
-    return erros
-
-
 def filtrar_por_erros(df: pd.DataFrame, erros_selecionados: list) -> pd.DataFrame:
     """
     Filtra o DataFrame para manter somente as linhas que contenham
-    ao menos um dos erros selecionados na coluna 'lista_erros'.
+    ao menos um dos erros selecionados (via bits da coluna 'codigo_erros').
     Se erros_selecionados for vazio, retorna o df original.
     """
     if not erros_selecionados:
         return df
-    mask = df["lista_erros"].apply(lambda lista: any(e in lista for e in erros_selecionados))
-    return df[mask]
+    return df[regras.mascara_erros(df["codigo_erros"], erros_selecionados)]
 
 
-def verificar_descontar_hove(df: pd.DataFrame) -> pd.DataFrame:
+def checar_erros_anymarket(df: pd.DataFrame) -> pd.Series:
     """
-    Verifica se, para "Repasse Normal" + "Descontar Hove/Houve",
-    o valor repassado no Repasse Normal (valor_liquido) é igual
-    (em valor absoluto) ao valor do evento "Descontar Hove/Houve" (valor_final).
-    
-    Se não bater, marca 'erro_descontar' = "ERRO_DEVOLUCAO".
-    Retorna um DataFrame auxiliar com as colunas:
-      - numero_pedido
-      - valor_liquido_repasse_normal
-      - repasse_liquido_evento_descontar_houve
-      - erro_descontar
+    Compara o valor do pedido com o valor da tabela 'vendas' (em centavos):
+    - Se não encontrar a venda (valor_vendas == 0) => ERRO_VENDA_NAO_ENCONTRADA
+    - Se for Repasse Normal e valor_liquido != valor_vendas => ERRO_VALORES_DIVERGENTES
+    Os dois casos são mutuamente exclusivos; linhas sem erro ficam com string vazia.
     """
-    subset = df[["numero_pedido", "tipo_evento_normalizado",
-                 "valor_liquido", "valor_final"]].copy()
-
-    grupos = []
-    # Agrupa por pedido para verificar se existe um "Repasse Normal" e um "Descontar Hove/Houve"
-    for pedido, grupo in subset.groupby("numero_pedido"):
-        valor_liquido_repasse_normal = None
-        repasse_hove = None
-
-        for _, row in grupo.iterrows():
-            if row["tipo_evento_normalizado"] == "Repasse Normal":
-                valor_liquido_repasse_normal = row["valor_liquido"]
-            elif row["tipo_evento_normalizado"] == "Descontar Hove/Houve":
-                repasse_hove = row["valor_final"]
-
-        # Se ambos existem, checamos se bate
-        if (valor_liquido_repasse_normal is not None) and (repasse_hove is not None):
-            if round(abs(valor_liquido_repasse_normal), 2) != round(abs(repasse_hove), 2):
-                erro = "ERRO_DEVOLUCAO"
-            else:
-                erro = ""
-            grupos.append({
-                "numero_pedido": pedido,
-                "valor_liquido_repasse_normal": valor_liquido_repasse_normal,
-                "repasse_liquido_evento_descontar_houve": repasse_hove,
-                "erro_descontar": erro
-            })
-
-    df_result = pd.DataFrame(grupos, columns=[
-        "numero_pedido",
-        "valor_liquido_repasse_normal",
-        "repasse_liquido_evento_descontar_houve",
-        "erro_descontar"
-    ])
-    # Garante que cada pedido apareça só uma vez
-    df_result = df_result.drop_duplicates(subset=["numero_pedido"])
-    return df_result
+    nao_encontrada = df["valor_vendas_centavos"] == 0
+    divergente = (
+        (df["tipo_evento_normalizado"] == "Repasse Normal")
+        & (df["valor_liquido_centavos"] != df["valor_vendas_centavos"])
+        & ~nao_encontrada
+    )
+    erros = np.select(
+        [nao_encontrada, divergente],
+        ["ERRO_VENDA_NAO_ENCONTRADA", "ERRO_VALORES_DIVERGENTES"],
+        default="",
+    )
+    return pd.Series(erros, index=df.index)
 
 
-def verificar_descontar_retroativo(df: pd.DataFrame) -> pd.DataFrame:
+def registros_vazios() -> pd.DataFrame:
     """
-    Verifica se, para "Descontar Retroativo", a soma de valor_final
-    (repasse_liquido_evento) é igual (em valor absoluto) ao valor_liquido do pedido.
-    Se for igual, marca "ERRO_DESCONTAR_RETROATIVO".
+    DataFrame sem linhas, com as colunas de `preparar_dados`. Usado pelas abas
+    de registros quando eles não são carregados (modo materializado).
     """
-    subset = df[df["tipo_evento_normalizado"] == "Descontar Retroativo"].copy()
-    if subset.empty:
-        return pd.DataFrame(columns=[
-            "numero_pedido",
-            "valor_liquido",
-            "soma_descontar_retroativo",
-            "Diferenca",
-            "erro_descontar_retroativo"
-        ])
-
-    grouped = subset.groupby("numero_pedido").agg({
-        "valor_liquido": "first",  # valor base do pedido
-        "valor_final": "sum"       # soma dos valores "Descontar Retroativo"
-    }).reset_index()
-
-    grouped.rename(columns={"valor_final": "soma_descontar_retroativo"}, inplace=True)
-    grouped["Diferenca"] = grouped["valor_liquido"] + grouped["soma_descontar_retroativo"]
-
-    def verificar_erro(row):
-        # Se a soma de desconto for igual ao valor do pedido (sem ser 0), marcamos erro
-        if (round(abs(row["soma_descontar_retroativo"]), 2) == round(abs(row["valor_liquido"]), 2)
-           and round(row["valor_liquido"], 2) != 0):
-            return "ERRO_DESCONTAR_RETROATIVO"
-        return ""
-
-    grouped["erro_descontar_retroativo"] = grouped.apply(verificar_erro, axis=1)
-    return grouped
+    df = pd.DataFrame({coluna: pd.Series(dtype=object) for coluna in [
+        "marketplace", "sku_marketplace_id", "numero_pedido", "valor_liquido", "valor_vendas",
+        "data_comissao", "porcentagem", "comissao_calc", "data_evento",
+        "tipo_evento", "valor_final", "data_ciclo", "tipo_evento_normalizado",
+    ]})
+    for coluna in ["valor_liquido_centavos", "valor_vendas_centavos", "valor_final_centavos",
+                   "porcentagem_pb", "comissao_centavos"]:
+        df[coluna] = pd.Series(dtype="int64")
+    return df.join(regras.aplicar_regras(df))
+
+
+@st.cache_data(ttl=60)
+def marca_resultados() -> str:
+    """
+    Marca da última execução do job de materialização. Consultada no máximo uma
+    vez por minuto; resultados novos aparecem assim que a marca muda.
+    """
+    return materializacao.ultima_execucao()
 
 
-@st.cache_data
-def carregar_vendas() -> pd.DataFrame:
+@st.cache_data(max_entries=64)
+def carregar_resultados(marca: str, situacoes: tuple, pedido: str) -> pd.DataFrame:
     """
-    Retorna um DataFrame com as vendas (id, sku_marketplace_id, valor_liquido).
-    Aqui chamamos de valor_vendas para evitar confusão.
+    Veredictos materializados por pedido (ver `materializacao.ler_resultados`),
+    cacheados pela execução do job (`marca_resultados`) e pelos filtros.
     """
-    query_vendas = text("""
-        SELECT
-            id AS venda_id,
-            sku_marketplace_id,
-            valor_liquido AS valor_vendas
-        FROM vendas
-    """)
-    return pd.read_sql(query_vendas, engine)
+    return materializacao.ler_resultados(list(situacoes), pedido)
 
 
-def montar_resumo_financeiro(df_geral: pd.DataFrame, df_vendas: pd.DataFrame) -> pd.DataFrame:
+def montar_resumo_financeiro(df_geral: pd.DataFrame) -> pd.DataFrame:
     """
     Retorna um DF consolidado para exibir em "Resumo Financeiro", com as colunas:
       - Marketplace
@@ -328,109 +116,31 @@ def montar_resumo_financeiro(df_geral: pd.DataFrame, df_vendas: pd.DataFrame) ->
       - Situação do pagamento
       - Situação final
 
-    Lógica:
-      - 'valor_vendas' é o valor do pedido obtido da tabela 'vendas'.
-      - 'comissao_esperada' é o maior comissao_calc do grupo para aquele pedido.
-      - 'valor_a_receber' = valor_total - comissao_esperada
-      - 'valor_recebido' = o max() de valor_final onde tipo_evento_normalizado = "Repasse Normal"
-      - 'valor_descontado' = soma de Hove/Houve + Retroativo
-      - 'desconto_frete' = soma de "Descontar Reversa Centauro Envios"
-      - 'situacao_pagamento' = "pago", "pago a maior", "pago a menor" ou "nao pago"
-      - 'situacao_final' = "Correta", "Erro Devolução" ou a situacao do pagamento
+    Os cálculos são os de `calcular_situacao_pedidos`; aqui os valores
+    são convertidos para reais e os pedidos com valor total 0 são removidos.
     """
-    # Mesclamos df_geral com df_vendas para obter a coluna "valor_vendas"
-    df_merge = df_geral.merge(
-        df_vendas,
-        how="left",
-        left_on="sku_marketplace_id",
-        right_on="sku_marketplace_id",
-        suffixes=("", "_vendas")
-    )
-    # Se não encontrar valor_vendas, consideramos 0
-    df_merge["valor_vendas"] = df_merge["valor_vendas"].fillna(0)
-
-    grupos = []
-    # Agrupamos por (marketplace, numero_pedido)
-    for (marketplace, pedido), grupo in df_merge.groupby(["marketplace", "numero_pedido"]):
-        # Data do pedido é a menor data_evento do grupo (ou None, se não existir)
-        data_pedido = grupo["data_evento"].min() if not grupo["data_evento"].isna().all() else None
-
-        # O valor total do pedido (max no grupo, geralmente é igual em todas as linhas)
-        valor_total = grupo["valor_vendas"].max()
-
-        # Comissão esperada (maior valor de comissao_calc)
-        comissao_esperada = grupo["comissao_calc"].max()
-        if pd.isna(comissao_esperada):
-            comissao_esperada = 0
-
-        valor_a_receber = valor_total - comissao_esperada
-
-        # Valor Recebido (Repasse Normal)
-        mask_rep_normal = (grupo["tipo_evento_normalizado"] == "Repasse Normal")
-        valor_recebido = grupo.loc[mask_rep_normal, "valor_final"].max()
-        if pd.isna(valor_recebido):
-            valor_recebido = 0
-
-        # Determina a situação do pagamento com base na diferença
-        diferenca = valor_recebido - valor_a_receber
-        if abs(diferenca) < 0.05:
-            situacao_pag = "pago"
-        elif diferenca > 0:
-            situacao_pag = "pago a maior"
-        elif valor_recebido > 0:
-            situacao_pag = "pago a menor"
-        else:
-            situacao_pag = "nao pago"
-
-        # Valor Descontado = soma de "Descontar Hove/Houve" e "Descontar Retroativo"
-        mask_hove = (grupo["tipo_evento_normalizado"] == "Descontar Hove/Houve")
-        # Neste exemplo, usamos max() para "Descontar Hove/Houve" (pode haver variações).
-        valor_hove = grupo.loc[mask_hove, "valor_final"].max()
-        if pd.isna(valor_hove):
-            valor_hove = 0
-
-        mask_retro = (grupo["tipo_evento_normalizado"] == "Descontar Retroativo")
-        # Aqui, somamos todas as linhas de retroativo
-        valor_retro = grupo.loc[mask_retro, "valor_final"].sum()
-        valor_descontado = valor_hove + valor_retro
-
-        # Desconto de frete => soma de "Descontar Reversa Centauro Envios"
-        mask_frete = (grupo["tipo_evento_normalizado"] == "Descontar Reversa Centauro Envios")
-        desconto_frete = grupo.loc[mask_frete, "valor_final"].sum()
-
-        # Checamos se há erro de devolução, assumindo que se "Descontar Hove/Houve" for != valor_total, há erro
-        erro_devolucao = False
-        if abs(valor_hove) > 0 and abs(valor_hove) != abs(valor_total):
-            erro_devolucao = True
-
-        if abs(diferenca) < 0.01 and not erro_devolucao:
-            situacao_final = "Correta"
-        elif erro_devolucao:
-            situacao_final = "Erro Devolução"
-        else:
-            situacao_final = situacao_pag
-
-        grupos.append({
-            "Marketplace": marketplace,
-            "CÓDIGO PEDIDO": pedido,
-            "DATA PEDIDO": data_pedido,
-            "VALOR TOTAL DOS PRODUTOS": valor_total,
-            "Comissão Esperada": comissao_esperada,
-            "Valor a Receber": valor_a_receber,
-            "Valor Recebido": valor_recebido,
-            "Situação do pagamento": situacao_pag,
-            "Valor Descontado": valor_descontado,
-            "Desconto frete": desconto_frete,
-            "Situação": situacao_final
-        })
-
-    df_resumo = pd.DataFrame(grupos)
+    situacao = calcular_situacao_pedidos(df_geral)
+    return formatar_resumo_financeiro(situacao[situacao["valor_total"] != 0])
 
-    # Remove do resumo linhas que tenham "VALOR TOTAL DOS PRODUTOS" = 0, caso existam
-    if not df_resumo.empty and "VALOR TOTAL DOS PRODUTOS" in df_resumo.columns:
-        df_resumo = df_resumo[df_resumo["VALOR TOTAL DOS PRODUTOS"] != 0].copy()
 
-    return df_resumo
+def formatar_resumo_financeiro(situacao: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte o resultado de `calcular_situacao_pedidos` (ou da tabela
+    materializada) nas colunas de exibição do "Resumo Financeiro", em reais.
+    """
+    return pd.DataFrame({
+        "Marketplace": situacao["marketplace"],
+        "CÓDIGO PEDIDO": situacao["numero_pedido"],
+        "DATA PEDIDO": situacao["data_pedido"],
+        "VALOR TOTAL DOS PRODUTOS": para_reais(situacao["valor_total"]),
+        "Comissão Esperada": para_reais(situacao["comissao_esperada"]),
+        "Valor a Receber": para_reais(situacao["valor_a_receber"]),
+        "Valor Recebido": para_reais(situacao["valor_recebido"]),
+        "Situação do pagamento": situacao["situacao_pagamento"],
+        "Valor Descontado": para_reais(situacao["valor_descontado"]),
+        "Desconto frete": para_reais(situacao["desconto_frete"]),
+        "Situação": situacao["situacao_final"]
+    }).reset_index(drop=True)
 
 
 # =========================================================================
@@ -448,7 +158,8 @@ def main():
         1) Visão Geral
         2) Resumo Financeiro
         3) Erros de Descontar Hove/Houve
-        4) Gráficos
+        4) Erros de Descontar Retroativo
+        5) Gráficos
     """
     st.title("Painel de Análises e Filtros (Com Data/Ciclo)")
 
@@ -457,15 +168,9 @@ def main():
     pedido_filtro = st.sidebar.text_input("Número do Pedido:", "")
     
     st.sidebar.header("Filtros de Tipo de Evento")
-    tipos_evento_padronizados = [
-        "Repasse Normal",
-        "Descontar Hove/Houve",
-        "Descontar Reversa Centauro Envios",
-        "Descontar Retroativo",
-        "Ajuste de Ciclo",
-        "Outros",
-        "Desconhecido"  # para eventos nulos ou vazios
-    ]
+    # Eventos padronizados de todos os marketplaces, mais "Outros" e
+    # "Desconhecido" (para eventos nulos ou vazios)
+    tipos_evento_padronizados = regras.eventos_padronizados()
     evento_filtro = st.sidebar.multiselect(
         "Selecione o(s) Tipo(s) de Evento:",
         tipos_evento_padronizados,
@@ -478,65 +183,100 @@ def main():
     data_fim = col2.date_input("Data final (comissão)", None)
 
     st.sidebar.header("Filtros por Erro")
-    opcoes_de_erros = [
-        "Valor Final Negativo",
-        "Falta de Comissão",
-        "Falta de Data de Comissão",
-        "Erro Cálculo Comissão",
-        "Erro Devolução",
-    ]
+    # Rótulos de erro declarados nas regras de conciliação (regras.py)
+    opcoes_de_erros = regras.rotulos_erro()
     erros_selecionados = st.sidebar.multiselect(
         "Selecione o(s) tipo(s) de erro:",
         opcoes_de_erros
     )
 
-    # ------------------- 1) CARREGAR DADOS -------------------
-    df = carregar_dados_geral()
-
-    # 1) Verificação de comissão => cria coluna "erro_comissao"
-    df["erro_comissao"] = df.apply(checar_erro_comissao, axis=1)
+    materializado = materializacao.MODO_RESULTADOS == "materializado"
+    carregar_registros = True
+    if materializado:
+        # O Resumo Financeiro lê a tabela materializada; as linhas de origem
+        # (carga e regras) só são processadas se o usuário pedir.
+        carregar_registros = st.sidebar.checkbox("Carregar registros detalhados", value=False)
 
-    # 2) Verificar "Descontar Hove/Houve" => data frame auxiliar
-    df_descontar_hove = verificar_descontar_hove(df)
-    df = df.merge(df_descontar_hove, on="numero_pedido", how="left")
-    if 'erro_descontar' not in df.columns:
-        # Se não houver, cria a coluna
-        df['erro_descontar'] = ''
+    # ------------------- 1) CARREGAR DADOS -------------------
+    versao = versao_dados()
+    # Estimativa de tamanho antes de carregar: decide entre o modo completo e o particionado
+    plano = planejar_memoria(versao) if carregar_registros else None
+    situacao_particionada = None
+
+    if plano is None:
+        df = registros_vazios()
+        df_retroativo = verificar_descontar_retroativo(df)
+        st.info(
+            "Resultados materializados: o Resumo Financeiro vem da tabela de resultados. "
+            "Marque \"Carregar registros detalhados\" para ver as demais abas."
+        )
+    elif plano.modo == memoria.MODO_COMPLETO:
+        # Dados + verificações 1) a 3), calculados uma vez por versão dos dados
+        df = preparar_dados(versao)
+        df_retroativo = preparar_retroativo(versao)
+        st.caption(f"Modo de memória: completo ({plano.descricao()}).")
+    else:
+        # Acima do orçamento: as abas de linhas usam uma amostra e o Resumo
+        # Financeiro usa os resultados por pedido de todas as partições
+        df, situacao_particionada, df_retroativo, total_linhas = preparar_dados_particionado(
+            versao, plano.linhas_por_particao
+        )
+        if pedido_filtro and memoria.despejo_em_disco():
+            # A busca por pedido lê os arquivos em disco e traz todas as linhas do pedido
+            encontrados = buscar_pedido_particionado(versao, pedido_filtro)
+            df = encontrados if not encontrados.empty else df.iloc[0:0]
+            if len(encontrados) >= memoria.BUSCA_MAX_LINHAS:
+                origem = (
+                    f"apenas as primeiras {memoria.BUSCA_MAX_LINHAS:,} linhas encontradas "
+                    "(refine o número do pedido)"
+                )
+            else:
+                origem = "todas as linhas dos pedidos encontrados"
+        else:
+            origem = f"uma amostra de {len(df):,} de {total_linhas:,} linhas"
+        aviso = (
+            f"Modo de memória reduzida ({plano.descricao()}). "
+            f"As abas de registros exibem {origem}; "
+            "o Resumo Financeiro considera todos os pedidos."
+        )
+        if not memoria.despejo_em_disco():
+            aviso += " MEMORIA_DIR está em memória: sem arquivos em disco, a busca por pedido se limita à amostra."
+        st.warning(aviso)
 
-    # 3) Erros adicionais => cria coluna "lista_erros"
-    df["lista_erros"] = df.apply(checar_erros_adicionais, axis=1)
+    # 4) Aplica os filtros iniciais. `df` é compartilhado pelo cache e não é
+    # alterado: cada filtro gera uma seleção nova, sem copiar o DataFrame inteiro.
+    df_filtrado = df
 
-    # 4) Aplica os filtros iniciais => copia para df_filtrado
-    df_filtrado = df.copy()
+    # Nenhum evento ou todos selecionados (o padrão): o filtro por evento não exclui nada
+    evento_restrito = bool(evento_filtro) and set(evento_filtro) != set(tipos_evento_padronizados)
+    filtros_ativos = bool(pedido_filtro or evento_restrito or (data_ini and data_fim) or erros_selecionados)
 
     # --- Filtro por Número do Pedido
     if pedido_filtro:
         df_filtrado = df_filtrado[df_filtrado["numero_pedido"].astype(str).str.contains(pedido_filtro, na=False)]
 
     # --- Filtro por Tipo de Evento
-    if evento_filtro:
+    if evento_restrito:
         df_filtrado = df_filtrado[df_filtrado["tipo_evento_normalizado"].isin(evento_filtro)]
 
     # --- Filtro por Data de Comissão
     if data_ini and data_fim:
-        df_filtrado["data_comissao"] = pd.to_datetime(df_filtrado["data_comissao"], errors="coerce")
+        data_comissao = pd.to_datetime(df_filtrado["data_comissao"], errors="coerce")
         df_filtrado = df_filtrado[
-            (df_filtrado["data_comissao"].notnull()) &
-            (df_filtrado["data_comissao"] >= pd.to_datetime(data_ini)) &
-            (df_filtrado["data_comissao"] <= pd.to_datetime(data_fim))
+            (data_comissao.notnull()) &
+            (data_comissao >= pd.to_datetime(data_ini)) &
+            (data_comissao <= pd.to_datetime(data_fim))
         ]
 
     # --- Filtro por erros selecionados
     df_filtrado = filtrar_por_erros(df_filtrado, erros_selecionados)
 
-    # 6) Carrega df_vendas (cacheado), se precisarmos comparar
-    df_vendas = carregar_vendas()
-
     # 7) Cria as abas do Streamlit
-    tab1, tab2, tab3, tab4 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
         "Visão Geral",
         "Resumo Financeiro",
         "Erros de Descontar Hove/Houve",
+        "Erros de Descontar Retroativo",
         "Gráficos",
     ])
 
@@ -598,8 +338,7 @@ def main():
         colD.metric("Soma Valor Final", f"{soma_val_final:,.2f}")
 
         # Quantos registros têm qualquer erro na lista_erros
-        df_filtrado["tem_algum_erro"] = df_filtrado["lista_erros"].apply(lambda x: len(x) > 0)
-        qtd_qualquer_erro = df_filtrado["tem_algum_erro"].sum()
+        qtd_qualquer_erro = (df_filtrado["codigo_erros"] != 0).sum()
         st.info(f"Registros com *qualquer erro*: {qtd_qualquer_erro}")
 
         # ---------------------------------------------------------
@@ -607,37 +346,15 @@ def main():
         # ---------------------------------------------------------
         st.markdown("## Visão Geral Anymarket")
 
-        # Mescla com df_vendas para verificar possíveis divergências
-        df_any = df_filtrado.merge(
-            df_vendas,
-            how="left",
-            left_on="sku_marketplace_id",
-            right_on="sku_marketplace_id",
-            suffixes=("", "_vendas")
-        )
-
-        # Substitui NaN em valor_vendas (significa que não achou a venda)
-        df_any["valor_vendas"] = df_any["valor_vendas"].fillna(0)
-
-        def checar_erros_anymarket(row):
-            """
-            - Se não encontrar a venda (valor_vendas == 0), retorna ERRO_VENDA_NAO_ENCONTRADA
-            - Se for Repasse Normal e valor_liquido != valor_vendas, retorna ERRO_VALORES_DIVERGENTES
-            """
-            erros = []
-            if row["valor_vendas"] == 0:
-                erros.append("ERRO_VENDA_NAO_ENCONTRADA")
-
-            if (
-                row["tipo_evento_normalizado"] == "Repasse Normal"
-                and round(row["valor_liquido"], 2) != round(row["valor_vendas"], 2)
-                and row["valor_vendas"] != 0
-            ):
-                erros.append("ERRO_VALORES_DIVERGENTES")
-
-            return erros
-
-        df_any["erros_anymarket"] = df_any.apply(checar_erros_anymarket, axis=1)
+        # valor_vendas já vem carregado junto com os dados (0 = venda não encontrada),
+        # então basta selecionar as colunas necessárias, sem novo merge.
+        df_any_exibe = df_filtrado[[
+            "numero_pedido",
+            "tipo_evento_normalizado",
+            "valor_liquido",
+            "valor_vendas"
+        ]].copy()
+        df_any_exibe["erros_anymarket"] = checar_erros_anymarket(df_filtrado)
 
         st.subheader("Filtrar por Erros Anymarket")
         error_options = [
@@ -648,15 +365,6 @@ def main():
         ]
         selected_any_error = st.selectbox("Selecione o tipo de erro a exibir", error_options, index=0)
 
-        colunas_any = [
-            "numero_pedido",
-            "tipo_evento_normalizado",
-            "valor_liquido",
-            "valor_vendas",
-            "erros_anymarket"
-        ]
-        df_any_exibe = df_any[colunas_any].copy()
-
         df_any_exibe = df_any_exibe.rename(columns={
             "numero_pedido": "Número do Pedido",
             "valor_liquido": "Valor (sku_marketplace/vendasDF)",
@@ -668,17 +376,11 @@ def main():
         # Remove duplicatas que podem ocorrer
         df_any_exibe = df_any_exibe.drop_duplicates(subset=["Número do Pedido", "Tipo de Evento"])
 
-        # Cria uma coluna para exibição fácil dos erros
-        df_any_exibe["ErrosStr"] = df_any_exibe["Erros Anymarket"].apply(lambda lista: ",".join(lista) if lista else "")
-
         # Filtra de acordo com a escolha do usuário
         if selected_any_error == "SEM_ERRO":
-            df_any_exibe = df_any_exibe[df_any_exibe["ErrosStr"] == ""]
-        elif selected_any_error == "ERRO_VENDA_NAO_ENCONTRADA":
-            df_any_exibe = df_any_exibe[df_any_exibe["ErrosStr"].str.contains("ERRO_VENDA_NAO_ENCONTRADA")]
-        elif selected_any_error == "ERRO_VALORES_DIVERGENTES":
-            df_any_exibe = df_any_exibe[df_any_exibe["ErrosStr"].str.contains("ERRO_VALORES_DIVERGENTES")]
-        # Se "Todos", não filtramos
+            df_any_exibe = df_any_exibe[df_any_exibe["Erros Anymarket"] == ""]
+        elif selected_any_error != "Todos":
+            df_any_exibe = df_any_exibe[df_any_exibe["Erros Anymarket"] == selected_any_error]
 
         df_any_exibe_style = df_any_exibe.style.format({
             "Valor (sku_marketplace/vendasDF)": "{:.2f}",
@@ -687,12 +389,8 @@ def main():
         st.dataframe(df_any_exibe_style)
 
         # Exibe métricas de quantos erros foram encontrados
-        todas_ocorrencias_any = []
-        for lista_e in df_any_exibe["Erros Anymarket"]:
-            todas_ocorrencias_any.extend(lista_e)
-
-        qtd_erro_venda_nao_encontrada = sum(e == "ERRO_VENDA_NAO_ENCONTRADA" for e in todas_ocorrencias_any)
-        qtd_erro_valores_diverg = sum(e == "ERRO_VALORES_DIVERGENTES" for e in todas_ocorrencias_any)
+        qtd_erro_venda_nao_encontrada = (df_any_exibe["Erros Anymarket"] == "ERRO_VENDA_NAO_ENCONTRADA").sum()
+        qtd_erro_valores_diverg = (df_any_exibe["Erros Anymarket"] == "ERRO_VALORES_DIVERGENTES").sum()
 
         colA1, colA2 = st.columns(2)
         colA1.metric("ERRO_VENDA_NAO_ENCONTRADA", qtd_erro_venda_nao_encontrada)
@@ -707,16 +405,48 @@ def main():
     with tab2:
         st.markdown("## Resumo Financeiro")
 
-        # Montamos o DF usando a função acima
-        df_financeiro = montar_resumo_financeiro(df_filtrado, df_vendas)
-
         # Filtro adicional de Situação (opcional)
         st.sidebar.header("Filtro Situação Resumo Financeiro")
-        situacoes_disponiveis = ["Correta", "pago", "pago a maior", "pago a menor", "nao pago", "Erro Devolução"]
-        filtro_situacao = st.sidebar.multiselect("Situação:", situacoes_disponiveis)
+        filtro_situacao = st.sidebar.multiselect("Situação:", regras.situacoes_resumo())
+
+        if materializado:
+            # Veredictos pré-calculados (app/materializacao.py): consulta indexada,
+            # filtrada no banco por situação e número do pedido.
+            st.caption(
+                "Resultados materializados: apenas os filtros de número do pedido "
+                "e de situação se aplicam a esta aba."
+            )
+            marca = marca_resultados()
+            if not marca:
+                st.info(
+                    "O job de materialização (app/materializacao.py) ainda não foi executado: "
+                    "não há resultados gravados."
+                )
+                df_financeiro = pd.DataFrame()
+            else:
+                df_resultados = carregar_resultados(marca, tuple(filtro_situacao), pedido_filtro)
+                df_resultados = df_resultados[df_resultados["valor_total"] != 0]
+                df_financeiro = formatar_resumo_financeiro(df_resultados)
+                df_financeiro["Correta desde"] = df_resultados["correta_desde"].to_numpy()
+        elif situacao_particionada is not None:
+            # Modo de memória reduzida: resultados por pedido de todas as partições
+            st.caption(
+                "Modo de memória reduzida: apenas os filtros de número do pedido "
+                "e de situação se aplicam a esta aba."
+            )
+            situacao = situacao_particionada[situacao_particionada["valor_total"] != 0]
+            if pedido_filtro:
+                situacao = situacao[situacao["numero_pedido"].astype(str).str.contains(pedido_filtro, na=False)]
+            df_financeiro = formatar_resumo_financeiro(situacao)
 
-        if filtro_situacao:
-            df_financeiro = df_financeiro[df_financeiro["Situação"].isin(filtro_situacao)]
+            if filtro_situacao:
+                df_financeiro = df_financeiro[df_financeiro["Situação"].isin(filtro_situacao)]
+        else:
+            # Montamos o DF usando a função acima
+            df_financeiro = montar_resumo_financeiro(df_filtrado)
+
+            if filtro_situacao:
+                df_financeiro = df_financeiro[df_financeiro["Situação"].isin(filtro_situacao)]
 
         if df_financeiro.empty:
             st.info("Nenhum dado no Resumo Financeiro (verifique filtros ou valor_total=0).")
@@ -802,9 +532,65 @@ def main():
             st.info("Nenhum erro de Descontar Hove/Houve com base nos filtros.")
 
     # ---------------------------------------------------------------------
-    # ABA 4: GRÁFICOS
+    # ABA 4: ERROS DE DESCONTAR RETROATIVO
     # ---------------------------------------------------------------------
     with tab4:
+        st.markdown("## Erros de Descontar Retroativo")
+
+        # Resumo por pedido já calculado para a versão; aqui só selecionamos os pedidos
+        if situacao_particionada is not None:
+            # Modo de memória reduzida: o resumo cobre todos os pedidos, mas a
+            # amostra não, então apenas o filtro de número do pedido se aplica.
+            st.caption(
+                "Modo de memória reduzida: apenas o filtro de número do pedido "
+                "se aplica a esta aba."
+            )
+            df_retro = df_retroativo
+            if pedido_filtro:
+                df_retro = df_retro[df_retro["numero_pedido"].astype(str).str.contains(pedido_filtro, na=False)]
+        elif not filtros_ativos:
+            df_retro = df_retroativo
+        else:
+            # Pedidos com eventos "Descontar Retroativo" que passaram pelos filtros
+            pedidos_retro = df_filtrado.loc[
+                df_filtrado["tipo_evento_normalizado"] == regras.DESCONTAR_RETROATIVO, "numero_pedido"
+            ]
+            df_retro = df_retroativo[df_retroativo["numero_pedido"].isin(pedidos_retro)]
+
+        somente_erros = st.checkbox("Exibir somente pedidos com erro", value=True)
+        qtd_pedidos_retro = len(df_retro)
+        df_retro_erro = df_retro[df_retro["erro_descontar_retroativo"] == "ERRO_DESCONTAR_RETROATIVO"]
+        df_retro_exibe = df_retro_erro if somente_erros else df_retro
+
+        # As métricas cobrem todos os pedidos com retroativo (não dependem da caixa acima)
+        colR1, colR2, colR3 = st.columns(3)
+        colR1.metric("Pedidos com Retroativo", qtd_pedidos_retro)
+        colR2.metric("Erros de Retroativo", len(df_retro_erro))
+        colR3.metric("Soma Descontar Retroativo", f"{df_retro['soma_descontar_retroativo'].sum():,.2f}")
+
+        if not df_retro_exibe.empty:
+            df_retro_exibe = df_retro_exibe.rename(columns={
+                "numero_pedido": "Número do Pedido",
+                "valor_liquido": "Valor Pedido",
+                "soma_descontar_retroativo": "Soma Descontar Retroativo",
+                "Diferenca": "Diferença",
+                "erro_descontar_retroativo": "Erro",
+            })
+            st.dataframe(df_retro_exibe.style.format({
+                "Valor Pedido": "{:.2f}",
+                "Soma Descontar Retroativo": "{:.2f}",
+                "Diferença": "{:.2f}",
+            }))
+            st.info(f"Diferença total (pedidos exibidos): {df_retro_exibe['Diferença'].sum():,.2f}")
+        elif somente_erros:
+            st.info("Nenhum erro de Descontar Retroativo com base nos filtros.")
+        else:
+            st.info("Nenhum pedido com Descontar Retroativo com base nos filtros.")
+
+    # ---------------------------------------------------------------------
+    # ABA 5: GRÁFICOS
+    # ---------------------------------------------------------------------
+    with tab5:
         st.markdown("## Gráficos e Visualizações")
 
         # 1) Gráfico de Barras: distribuição de tipo de evento
@@ -817,19 +603,24 @@ def main():
 
         # 2) Gráfico de Erros (Barrinhas e Pizza)
         st.subheader("Distribuição de Erros Encontrados")
-        todas_ocorrencias = []
-        for lista_e in df_filtrado["lista_erros"]:
-            todas_ocorrencias.extend(lista_e)
-
-        if not todas_ocorrencias:
+        # Contagem por rótulo a partir dos bits de 'codigo_erros' (sem percorrer as listas)
+        contagem = pd.Series({
+            rotulo: regras.mascara_erros(df_filtrado["codigo_erros"], [rotulo]).sum()
+            for rotulo in regras.rotulos_erro()
+        }, dtype="int64")
+        contagem = contagem[contagem > 0].sort_values(ascending=False)
+
+        if contagem.empty:
             st.info("Nenhum erro no dataset filtrado.")
         else:
-            contagem = pd.Series(todas_ocorrencias).value_counts()
 
             st.write("**Gráfico de Barras**:")
             st.bar_chart(contagem)
 
             st.write("**Gráfico de Pizza**:")
+            # Import tardio: o matplotlib só é necessário aqui e pesa no início do contêiner
+            import matplotlib.pyplot as plt
+
             fig, ax = plt.subplots()
             ax.pie(contagem.values, labels=contagem.index, autopct="%1.1f%%")
             ax.axis("equal")  # Mantém o círculo perfeito
@@ -837,4 +628,10 @@ def main():
 
 
 if __name__ == "__main__":
+    # Tempo da primeira renderização, reportado no log só na primeira execução do
+    # processo. O import dos módulos é medido no aquecimento (`aquecimento.py`),
+    # que os carrega antes da primeira execução do script.
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    _inicio_render = time.perf_counter()
     main()
+    registrar_tempo("Primeira renderização", time.perf_counter() - _inicio_render)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Os módulos da aplicação se importam pelo nome (ex.: `import regras`), como
+# quando executados a partir de app/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
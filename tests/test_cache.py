@@ -0,0 +1,86 @@
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import cache as modulo_cache
+import memoria
+from cache import BackendCache, CacheCompartilhado, CacheDisco, CacheNenhum, CacheRedis, ClienteRedisMemoria
+
+
+def test_single_flight_entre_instancias_com_redis_em_memoria():
+    # Duas "instâncias" (cada uma com o seu CacheCompartilhado) sobre o mesmo Redis
+    backend = CacheRedis(ClienteRedisMemoria())
+    instancias = [CacheCompartilhado(backend, intervalo_espera=0.01) for _ in range(2)]
+    calculos = []
+    resultados = []
+
+    def calcular():
+        calculos.append(1)
+        time.sleep(0.2)
+        return pd.DataFrame({"numero_pedido": ["1", "2"], "valor": [10, 20]})
+
+    def executar(cache):
+        resultados.append(cache.obter_ou_calcular("dados_geral:v1", calcular))
+
+    threads = [threading.Thread(target=executar, args=(cache,)) for cache in instancias]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calculos) == 1
+    assert len(resultados) == 2
+    pd.testing.assert_frame_equal(resultados[0], resultados[1])
+
+
+class _BackendIndisponivel(BackendCache):
+    def ler(self, chave):
+        raise ConnectionError("indisponível")
+
+    def gravar(self, chave, dados):
+        raise ConnectionError("indisponível")
+
+    def adquirir_trava(self, chave, validade):
+        raise ConnectionError("indisponível")
+
+    def liberar_trava(self, chave, token):
+        raise ConnectionError("indisponível")
+
+
+def test_backend_indisponivel_calcula_localmente():
+    cache = CacheCompartilhado(_BackendIndisponivel())
+    df = cache.obter_ou_calcular("dados_geral:v1", lambda: pd.DataFrame({"valor": [1]}))
+    assert list(df["valor"]) == [1]
+
+
+def test_obter_cache_sem_backend_utilizavel_usa_cache_nenhum(monkeypatch, tmp_path):
+    modulo_cache.obter_cache.cache_clear()
+    monkeypatch.delenv("CACHE_BACKEND", raising=False)
+    assert isinstance(modulo_cache.obter_cache().backend, CacheNenhum)
+
+    # Diretório em memória (tmpfs) é recusado
+    modulo_cache.obter_cache.cache_clear()
+    monkeypatch.setenv("CACHE_BACKEND", "disco")
+    monkeypatch.setenv("CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(memoria, "em_memoria", lambda diretorio: True)
+    assert isinstance(modulo_cache.obter_cache().backend, CacheNenhum)
+
+    modulo_cache.obter_cache.cache_clear()
+    monkeypatch.setattr(memoria, "em_memoria", lambda diretorio: False)
+    assert isinstance(modulo_cache.obter_cache().backend, CacheDisco)
+
+    # Diretório sem permissão de escrita
+    modulo_cache.obter_cache.cache_clear()
+    arquivo = tmp_path / "arquivo"
+    arquivo.write_text("")
+    monkeypatch.setenv("CACHE_DIR", str(arquivo / "cache"))
+    assert isinstance(modulo_cache.obter_cache().backend, CacheNenhum)
+
+    # Pacote `redis` ausente
+    modulo_cache.obter_cache.cache_clear()
+    monkeypatch.setenv("CACHE_BACKEND", "redis")
+    monkeypatch.setitem(sys.modules, "redis", None)
+    assert isinstance(modulo_cache.obter_cache().backend, CacheNenhum)
+    modulo_cache.obter_cache.cache_clear()
@@ -0,0 +1,29 @@
+import pandas as pd
+
+import dados
+
+
+def test_blocos_por_pedido_nao_divide_pedidos():
+    pedidos = ["1", "1", "2", "2", "2", "3", "4", "4", None, None]
+    blocos = [
+        pd.DataFrame({"numero_pedido": pedidos[i:i + 3], "linha": range(i, min(i + 3, len(pedidos)))})
+        for i in range(0, len(pedidos), 3)
+    ]
+
+    recortados = list(dados.blocos_por_pedido(blocos))
+
+    assert sum(len(b) for b in recortados) == len(pedidos)
+    vistos = set()
+    for bloco in recortados:
+        atuais = set(bloco["numero_pedido"].fillna("nulo"))
+        assert not atuais & vistos
+        vistos |= atuais
+    assert list(pd.concat(recortados)["linha"]) == list(range(len(pedidos)))
+
+
+def test_blocos_por_pedido_sem_linhas():
+    vazio = pd.DataFrame({"numero_pedido": pd.Series([], dtype=object)})
+
+    recortados = list(dados.blocos_por_pedido([vazio]))
+
+    assert len(recortados) == 1 and recortados[0].empty
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from dinheiro import aplicar_pontos_base, para_centavos, para_pontos_base, para_reais
+
+
+def test_para_centavos_arredonda_meio_para_longe_do_zero():
+    valores = pd.Series([0.285, -0.285, 1.005, 0.125, -0.125, 0.124, 7, 0.0])
+
+    centavos = para_centavos(valores)
+
+    # 0.285 * 100 = 28.499999999999996 e 1.005 * 100 = 100.49999999999999:
+    # a folga (_EPSILON) absorve o erro de representação antes de arredondar
+    assert list(centavos) == [29, -29, 101, 13, -13, 12, 700, 0]
+    assert centavos.dtype == "int64"
+
+
+def test_para_centavos_nulos_e_decimal():
+    valores = pd.Series([None, np.nan, Decimal("12.345"), Decimal("-0.005"), "abc"], dtype=object)
+
+    assert list(para_centavos(valores)) == [0, 0, 1235, -1, 0]
+
+
+def test_para_pontos_base():
+    porcentagens = pd.Series([0.1234, 0.16, 0.00005, -0.00005, np.nan, Decimal("0.0725")], dtype=object)
+
+    pontos = para_pontos_base(porcentagens)
+
+    assert list(pontos) == [1234, 1600, 1, -1, 0, 725]
+    assert pontos.dtype == "int64"
+
+
+def test_aplicar_pontos_base_arredonda_meio_para_longe_do_zero():
+    centavos = pd.Series([10000, 12345, 5, -5, 15, -15, 10015])
+    pontos = pd.Series([1000, 1250, 1000, 1000, 5000, 5000, 1000])
+
+    comissao = aplicar_pontos_base(centavos, pontos)
+
+    # 1543,125 -> 1543; 0,5 -> 1; -0,5 -> -1; 7,5 -> 8; -7,5 -> -8; 1001,5 -> 1002
+    assert list(comissao) == [1000, 1543, 1, -1, 8, -8, 1002]
+    assert comissao.dtype == "int64"
+
+
+def test_para_reais():
+    assert list(para_reais(pd.Series([12345, -5, 0]))) == [123.45, -0.05, 0.0]
@@ -0,0 +1,58 @@
+import pandas as pd
+
+import materializacao
+import regras
+
+
+def _dados(linhas):
+    """
+    DataFrame no formato de `ler_dados_geral` (apenas as colunas usadas pelas regras).
+    """
+    colunas = [
+        "marketplace", "numero_pedido", "tipo_evento_normalizado",
+        "valor_liquido_centavos", "valor_vendas_centavos", "valor_final_centavos",
+        "porcentagem_pb", "comissao_centavos", "data_comissao", "data_evento",
+    ]
+    return pd.DataFrame(linhas, columns=colunas)
+
+
+def test_calcular_resultados_por_pedido():
+    df = _dados([
+        # Pedido 1: repasse correto (10000 - 10% = 9000)
+        ("Centauro", "1", regras.REPASSE_NORMAL, 10000, 10000, 9000, 1000, 1000, "2024-01-02", "2024-01-01"),
+        # Pedido 2: sem comissão e devolução diferente do repasse
+        ("Centauro", "2", regras.REPASSE_NORMAL, 5000, 5000, 5000, 0, 0, None, "2024-01-03"),
+        ("Centauro", "2", regras.DESCONTAR_HOVE, 5000, 5000, -4000, 0, 0, None, "2024-01-03"),
+    ])
+
+    resultados = materializacao.calcular_resultados(df).set_index("numero_pedido")
+
+    assert resultados.loc["1", "lista_erros"] == []
+    assert resultados.loc["1", "situacao_final"] == "Correta"
+    assert not resultados.loc["1", "erro_descontar"]
+
+    assert set(resultados.loc["2", "lista_erros"]) == {
+        "Falta de Comissão", "Falta de Data de Comissão", "Erro Devolução",
+    }
+    assert resultados.loc["2", "erro_descontar"]
+    assert resultados.loc["2", "situacao_final"] == "Erro Devolução"
+
+
+def test_comparar_hashes_mantem_hash_inteiro_com_pedidos_removidos():
+    atuais = pd.DataFrame({
+        "marketplace": pd.array(["Centauro", "Centauro"], dtype="string"),
+        "numero_pedido": pd.array(["1", "2"], dtype="string"),
+        "hash_origem": [2505871976, 10],
+    })
+    gravados = pd.DataFrame({
+        "marketplace": ["Centauro", "Centauro"],
+        "numero_pedido": ["2", "3"],
+        "hash_origem": [10, 7],
+    })
+
+    alterados, removidos = materializacao.comparar_hashes(atuais, gravados)
+
+    assert list(alterados["numero_pedido"]) == ["1"]
+    assert alterados["hash_origem"].dtype == "int64"
+    assert alterados[["hash_origem"]].to_csv(index=False, header=False).strip() == "2505871976"
+    assert list(removidos["numero_pedido"]) == ["3"]
@@ -0,0 +1,46 @@
+import pandas as pd
+
+import memoria
+
+
+def test_buscar_limita_linhas(tmp_path, monkeypatch):
+    monkeypatch.setattr(memoria, "DIRETORIO_DESPEJO", str(tmp_path))
+    despejo = memoria.Despejo("v1")
+    despejo.limpar()
+    for indice in range(3):
+        despejo.gravar(f"particao_{indice:04d}", pd.DataFrame({
+            "numero_pedido": [f"{indice}{n:04d}" for n in range(100)],
+            "valor": range(100),
+        }))
+
+    assert len(despejo.buscar("numero_pedido", "1")) == 138
+    assert len(despejo.buscar("numero_pedido", "1", limite=30)) == 30
+    assert list(despejo.buscar("numero_pedido", "20042")["valor"]) == [42]
+    assert despejo.buscar("numero_pedido", "x").empty
+
+
+def test_planejar_particiona_acima_do_orcamento(monkeypatch):
+    monkeypatch.setenv("MEMORIA_ORCAMENTO_MB", "1")
+    monkeypatch.setattr(memoria, "BYTES_POR_LINHA", 1024)
+
+    assert memoria.planejar(1000).modo == memoria.MODO_COMPLETO
+    plano = memoria.planejar(10_000)
+    assert plano.modo == memoria.MODO_PARTICIONADO
+    assert plano.particoes == 20
+    assert plano.linhas_por_particao == 512
+
+
+def test_amostra_limitada_pelas_linhas_lidas():
+    amostra = memoria.Amostra(tamanho=100)
+    for indice in range(5):
+        amostra.incluir(pd.DataFrame({"linha": range(indice * 1000, (indice + 1) * 1000)}))
+
+    resultado = amostra.resultado()
+    assert len(resultado) == 100
+    assert resultado["linha"].is_unique
+    # Uniforme: partições lidas no início e no fim aparecem na amostra
+    assert resultado["linha"].min() < 1000 and resultado["linha"].max() >= 4000
+
+    pequena = memoria.Amostra(tamanho=100)
+    pequena.incluir(pd.DataFrame({"linha": range(30)}))
+    assert len(pequena.resultado()) == 30
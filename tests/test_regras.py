@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+import regras
+from conciliacao import verificar_descontar_retroativo
+from dinheiro import aplicar_pontos_base, para_centavos, para_pontos_base
+
+
+def test_classificar_situacoes_centauro():
+    pedidos = pd.DataFrame({
+        "marketplace": ["Centauro"] * 6,
+        "valor_total": [10000, 10000, 10000, 10000, 10000, 10000],
+        "valor_a_receber": [9000, 9000, 9000, 9000, 9000, 9000],
+        "valor_recebido": [9000, 9003, 9500, 8000, 0, 9000],
+        "valor_hove": [0, 0, 0, 0, 0, -4000],
+    })
+
+    pagamento, final = regras.classificar_situacoes(pedidos)
+
+    assert list(pagamento) == ["pago", "pago", "pago a maior", "pago a menor", "nao pago", "pago"]
+    assert list(final) == ["Correta", "pago", "pago a maior", "pago a menor", "nao pago", "Erro Devolução"]
+    assert set(final) <= set(regras.situacoes_resumo())
+
+
+def test_erro_calculo_comissao_no_limite_de_cinco_centavos():
+    # Em reais: 100,15 com 10% de comissão (10,015 -> R$10,02). valor_final de
+    # 90,08 e 90,18 ficam exatamente R$0,05 abaixo e acima do esperado (90,13,
+    # dentro da tolerância); 90,07 fica R$0,06 abaixo (erro). Em float, 100.15 - 10.02 - 90.08 dá
+    # 0.05000000000001137, que passaria da tolerância.
+    reais = pd.DataFrame({
+        "valor_liquido": [100.15, 100.15, 100.15],
+        "porcentagem": [0.1, 0.1, 0.1],
+        "valor_final": [90.08, 90.07, 90.18],
+    })
+    df = pd.DataFrame({
+        "marketplace": "Centauro",
+        "numero_pedido": ["1", "2", "3"],
+        "tipo_evento_normalizado": regras.REPASSE_NORMAL,
+        "valor_liquido_centavos": para_centavos(reais["valor_liquido"]),
+        "valor_final_centavos": para_centavos(reais["valor_final"]),
+        "porcentagem_pb": para_pontos_base(reais["porcentagem"]),
+        "data_comissao": "2024-01-02",
+    })
+    df["comissao_centavos"] = aplicar_pontos_base(df["valor_liquido_centavos"], df["porcentagem_pb"])
+
+    resultado = regras.aplicar_regras(df)
+
+    assert list(df["comissao_centavos"]) == [1002, 1002, 1002]
+    assert list(resultado["erro_comissao"]) == ["", "ERRO", ""]
+    assert list(resultado["lista_erros"]) == [[], ["Erro Cálculo Comissão"], []]
+
+
+def _erro_retroativo_antigo(grupo: pd.DataFrame) -> str:
+    """
+    Semântica original: erro se a soma dos "Descontar Retroativo" for, em valor
+    absoluto, igual ao valor do pedido, e o valor do pedido não for zero.
+    """
+    valor_liquido = grupo["valor_liquido"].iloc[0]
+    soma = grupo["valor_final"].sum()
+    if round(abs(soma), 2) == round(abs(valor_liquido), 2) and round(valor_liquido, 2) != 0:
+        return "ERRO_DESCONTAR_RETROATIVO"
+    return ""
+
+
+def test_erro_descontar_retroativo_igual_a_semantica_original():
+    gerador = np.random.default_rng(0)
+    linhas = []
+    for pedido in range(300):
+        valor = 0.0 if pedido % 10 == 0 else gerador.integers(1, 100_000) / 100
+        partes = int(gerador.integers(1, 4))
+        if pedido % 3 == 0:
+            # Retroativos que somam exatamente o valor do pedido (em partes)
+            cortes = np.sort(gerador.integers(0, int(round(valor * 100)) + 1, partes - 1))
+            centavos = np.diff(np.concatenate([[0], cortes, [int(round(valor * 100))]]))
+            valores = [-c / 100 for c in centavos]
+        else:
+            valores = list(-gerador.integers(0, 100_000, partes) / 100)
+        for valor_final in valores:
+            linhas.append((str(pedido), valor, valor_final))
+
+    reais = pd.DataFrame(linhas, columns=["numero_pedido", "valor_liquido", "valor_final"])
+    df = reais.assign(
+        marketplace="Centauro",
+        tipo_evento_normalizado=regras.DESCONTAR_RETROATIVO,
+        valor_liquido_centavos=para_centavos(reais["valor_liquido"]),
+        valor_final_centavos=para_centavos(reais["valor_final"]),
+        porcentagem_pb=0,
+        comissao_centavos=0,
+        data_comissao=None,
+    )
+    df = df.join(regras.aplicar_regras(df))
+
+    resumo = verificar_descontar_retroativo(df).set_index("numero_pedido")
+    esperado = reais.groupby("numero_pedido").apply(_erro_retroativo_antigo)
+
+    assert (esperado == "ERRO_DESCONTAR_RETROATIVO").sum() > 50
+    pd.testing.assert_series_equal(
+        resumo["erro_descontar_retroativo"].sort_index(),
+        esperado.sort_index(),
+        check_names=False,
+    )
+    # Pedidos de valor zero nunca são marcados, mesmo com soma zero
+    assert (resumo.loc[[str(p) for p in range(0, 300, 10)], "erro_descontar_retroativo"] == "").all()
+    # O rótulo entra em lista_erros das linhas do pedido
+    com_erro = df["erro_descontar_retroativo"] == "ERRO_DESCONTAR_RETROATIVO"
+    assert df.loc[com_erro, "lista_erros"].map(lambda erros: "Erro Descontar Retroativo" in erros).all()